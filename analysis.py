@@ -1,6 +1,7 @@
 import numpy as np
 import math
 import sqlite3 as sql
+from sat.columns import ColumnStore
 
 ### Calculating entropy
 def lb(x):
@@ -26,4 +27,8 @@ def print_table_schemes(fname, *tables):
                 print(format_template.format(name, data_type, pk))
             print()
 
-
+### Columnar exports, see export.py
+def load_search_runs(directory, experiment_id=None):
+    """ The search_run columns of an export, of one experiment or of all,
+    as memory mapped arrays; e.g. runs['h_1'] / runs['flips']. """
+    return ColumnStore(directory).searchRuns(experiment_id)
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+
+from sat.columns import exportColumns
+import sys
+import time
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    if len(sys.argv) != 3:
+        print(
+            'Usage: export.py <source.db> <target directory>',
+            file=sys.stderr
+        )
+        sys.exit(1)
+
+    source, target = sys.argv[1:]
+
+    begin = time.time()
+    try:
+        exportColumns(source, target)
+    except Exception as e:
+        print(
+            'Error: While exporting: {}.'
+            .format(e),
+            file=sys.stderr
+        )
+        sys.exit(1)
+    print(
+        'Exported {} into {} after {:.1f} seconds.'
+        .format(source, target, time.time() - begin)
+    )
+
+    sys.exit(0)
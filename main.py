@@ -2,161 +2,16 @@
 
 from sat.experiment import *
 from sat.prob_sat import *
+from sat.store import ResultStore, StoreWriter, finishedTasks, runTimes
 import sys
 import os
 import time
 import io
-import sqlite3
+import signal
 
 from experiments import experiments, short_cut
 
 
-make_experiment = """
-CREATE TABLE IF NOT EXISTS experiment
-    ( id              INTEGER PRIMARY KEY
-    , experiment_name TEXT
-    )
-"""
-
-save_experiment = """
-INSERT INTO experiment
-    ( experiment_name )
-VALUES
-    (?)
-"""
-
-make_algorithm_run = """
-CREATE TABLE IF NOT EXISTS algorithm_run
-    ( id            INTEGER PRIMARY KEY
-    , experiment_id INTEGER
-    , solver        TEXT
-    , formula_fname TEXT
-    , max_clause_len    INTEGER
-    , variables     INTEGER
-    , clauses       INTEGER
-    , cb            REAL
-    , time          INTEGER
-    , sat           BOOL
-    , FOREIGN KEY(experiment_id) REFERENCES experiment(id)
-    )
-"""
-
-save_algorithm_run = """
-INSERT INTO algorithm_run
-    ( experiment_id
-    , solver
-    , formula_fname
-    , max_clause_len
-    , variables
-    , clauses
-    , cb
-    , time
-    , sat
-    )
-VALUES
-    (?,?,?,?,?,?,?,?,?)
-"""
-
-make_search_run = """
-CREATE TABLE IF NOT EXISTS search_run
-    ( id               INTEGER PRIMARY KEY
-    , algorithm_run_id INTEGER
-    , flips            INTEGER
-    , minimal_unsat    INTEGER
-    , last_unsat       INTEGER
-    , h_1              REAL
-    , h_2              REAL
-    , min_h            REAL
-    , FOREIGN KEY(algorithm_run_id) REFERENCES algorithm_run(id)
-    )
-"""
-
-save_search_run = """
-INSERT INTO search_run
-    ( algorithm_run_id
-    , flips
-    , minimal_unsat
-    , last_unsat
-    , h_1
-    , h_2
-    , min_h
-    )
-VALUES
-    (?,?,?,?,?,?,?)
-"""
-
-make_dist_1 = """
-CREATE TABLE IF NOT EXISTS dist_1
-    ( id        INTEGER PRIMARY KEY
-    , run_id    INTEGER
-    , label     TEXT
-    , variable  INTEGER
-    , measure   REAL
-    , FOREIGN KEY(run_id) REFERENCES search_run(id)
-    )
-"""
-
-save_dist_1 = """
-INSERT INTO dist_1
-    ( run_id
-    , label
-    , variable
-    , measure
-    )
-VALUES
-    (?, ?, ?, ?)
-"""
-
-make_dist_2 = """
-CREATE TABLE IF NOT EXISTS dist_2
-    ( id         INTEGER PRIMARY KEY
-    , run_id     INTEGER
-    , label      TEXT
-    , variable_1 INTEGER
-    , variable_2 INTEGER
-    , measure    REAL
-    , FOREIGN KEY(run_id) REFERENCES search_run(id)
-    )
-"""
-
-save_dist_2 = """
-INSERT INTO dist_2
-    ( run_id
-    , label
-    , variable_1
-    , variable_2
-    , measure
-    )
-VALUES
-    (?,?,?,?,?)
-"""
-
-def lb(x):
-    return 0 if x == 0 else math.log(x, 2)
-
-def entropy(p):
-    return -p * lb(p)
-
-def eval_dist(dist):
-    s = sum([c for _,c in dist.items()])
-    probs = {k: c/s for k,c in dist.items()}
-    entropies = {k:entropy(p) for k,p in probs.items()}
-    max_h = max(entropies, key = entropies.get)
-    min_h = min(entropies, key = entropies.get)
-    max_p = max(probs, key = probs.get)
-    min_p = min(probs, key = probs.get)
-    h = sum(entropies.values())
-
-    return (
-        h,
-        {
-            'max_h': (max_h, entropies[max_h]),
-            'min_h': (min_h, entropies[min_h]),
-            'max_p': (max_p, probs[max_p]),
-            'min_p': (min_p, probs[min_p])
-        }
-    )
-
 if __name__ == '__main__':
     # Parse arguments
     if len(sys.argv) <= 1:
@@ -180,10 +35,18 @@ if __name__ == '__main__':
         sys.exit(1)
 
     repeat = 1
-    outfile_path = '{}.db'.format(experiment_name)
+    outfile_path = None
     poolsize = 1
     input_root = ''
     output_root = ''
+    formula_cache = None
+    trace_dir = None
+    trace_unsat = False
+    writer_process = False
+    shard_dir = None
+    sweep = None
+    sweep_count = 1
+    seed = None
 
     ## Loop through arguments
     i = 2
@@ -219,6 +82,36 @@ if __name__ == '__main__':
         elif sys.argv[i] == '--output_root':
             i += 1
             output_root = sys.argv[i]
+        elif sys.argv[i] == '--formula_cache':
+            i += 1
+            formula_cache = sys.argv[i]
+        elif sys.argv[i] == '--trace_dir':
+            i += 1
+            trace_dir = sys.argv[i]
+        elif sys.argv[i] == '--trace_unsat':
+            trace_unsat = True
+        elif sys.argv[i] == '--writer_process':
+            writer_process = True
+        elif sys.argv[i] == '--shard_dir':
+            i += 1
+            shard_dir = sys.argv[i]
+        elif sys.argv[i] == '--seed':
+            i += 1
+            seed = sys.argv[i]
+        elif sys.argv[i] == '--sweep':
+            i += 1
+            sweep = sys.argv[i].split(',')
+        elif sys.argv[i] == '--sweep_count':
+            i += 1
+            try:
+                sweep_count = int(sys.argv[i])
+            except ValueError:
+                print(
+                    'Error: Could not parse \'{}\' into an int.'
+                    .format(sys.argv[i]),
+                    file=sys.stderr
+                )
+                sys.exit(1)
         else:
             print(
                 'Warning: Unknown flag: {}.'.format(sys.argv[i]),
@@ -227,10 +120,37 @@ if __name__ == '__main__':
         i += 1
 
 
+    # The sample of formulae and the solver seeds follow from the seed, so
+    # a rerun with the same seed resumes the same tasks. Runs with other
+    # seeds are independent, and get their own database by default.
+    if outfile_path == None:
+        if seed == None:
+            outfile_path = '{}.db'.format(experiment_name)
+        else:
+            outfile_path = '{}-{}.db'.format(experiment_name, seed)
+    if seed == None:
+        seed = experiment_name
     outfile_path = os.path.join(output_root, outfile_path)
     # Running the experiment.
     try:
         experiment = experiments[experiment_name]
+        if formula_cache:
+            experiment = dict(
+                experiment,
+                config = dict(
+                    experiment['config'],
+                    formulaCache = formula_cache,
+                ),
+            )
+        if trace_dir:
+            experiment = dict(
+                experiment,
+                config = dict(
+                    experiment['config'],
+                    trace = trace_dir,
+                    traceUnsat = trace_unsat,
+                ),
+            )
     except KeyError:
         print(
             'Error: The experiment \'{}\' was not specified.'
@@ -247,138 +167,107 @@ if __name__ == '__main__':
         sys.exit(1)
 
 
-    with sqlite3.connect(outfile_path, timeout=5*60) as conn:
-        c = conn.cursor()
-        c.execute(make_experiment)
-        c.execute(make_algorithm_run)
-        c.execute(make_search_run)
-        c.execute(make_dist_1)
-        c.execute(make_dist_2)
-
-        conn.commit()
-
-        total_time = 0
-        need_label = True
-        i = 0
-        while i < repeat:
-            # results = []
-            # Initialize the experiment.
-            try:
-                dirs = list(
-                    map(
-                        lambda d: os.path.join(input_root,d),
-                        experiment['dirs']
-                    )
-                )
-                exp = Experiment(
-                    directories = dirs,
-                    solver = experiment['solver'],
-                    prob   = experiment['prob'],
-                    config = experiment['config'],
-                    poolsize = poolsize,
+    # A walltime kill (SIGTERM) exits normally, so the buffered results are
+    # still written.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    # Tasks finished by earlier invocations of the same command are
+    # skipped, and their stored times feed the cost model.
+    finished = finishedTasks(outfile_path, experiment_name)
+    times = runTimes(outfile_path)
+    if shard_dir and os.path.isdir(shard_dir):
+        for f in os.listdir(shard_dir):
+            if f.endswith('.db'):
+                finished |= finishedTasks(
+                    os.path.join(shard_dir, f),
+                    experiment_name
                 )
-            except Exception as e:
-                print(
-                    'Error: While initializing the experiment: {}.'
-                    .format(e),
-                    file=sys.stderr
-                )
-                sys.exit(1)
+                times.update(runTimes(os.path.join(shard_dir, f)))
 
-            # Run the experiment.
-            try:
-                print(
-                    'Experiment #{} {}... '.format(i, experiment_name),
-                    file=sys.stdout,
-                    end='',
-                    flush=True
-                )
-                exp_begin = time.time()
-                exp.runExperiment()
-                exp_end = time.time()
-                exp_dur = exp_end - exp_begin
-                print(
-                    'done after {:10d} seconds.'.format(int(exp_dur)),
-                    file=sys.stdout,
-                    end='\n',
-                    flush=True
-                )
-            except ValueError as e:
-                print(
-                    'Error: While running the experiment: {}.'
-                    .format(e),
-                    file=sys.stderr
-                )
-                sys.exit(1)
-
-            # Extract the results
-            # results += exp.results
-
-
-            # Save the results
-            # with sqlite3.connect(outfile_path, timeout=5*60) as conn:
-            c.execute(save_experiment, (experiment_name,))
-            exp_id = c.lastrowid
-            for result in exp.results:
-                c.execute(
-                    save_algorithm_run,
-                    (
-                        exp_id,
-                        "probSAT",
-                        result['formula_fname'],
-                        result['max_clause_len'],
-                        result['variables'],
-                        result['clauses'],
-                        result['cb'],
-                        result['time'],
-                        result['sat'],
-                    )
-                )
-                alg_id = c.lastrowid
-                for run in result['runs']:
-
-                    h_1, ms_1 = eval_dist(run['dist_1'])
-                    h_2, ms_2 = eval_dist(run['dist_2'])
-
-                    c.execute(
-                        save_search_run,
-                        (
-                            alg_id,
-                            run['flips'],
-                            run['minimal_unsat'],
-                            run['last_unsat'],
-                            h_1,
-                            h_2,
-                            run['min_h'],
-                        ),
-                    )
-
-                    run_id = c.lastrowid
-                    for lbl, (var, measure) in ms_1.items():
-                        c.execute(
-                            save_dist_1,
-                            (
-                                run_id,
-                                lbl,
-                                var,
-                                measure,
-                            )
-                        )
-                    for lbl, ((var_1, var_2), measure) in ms_2.items():
-                        c.execute(
-                            save_dist_2,
-                            (
-                                run_id,
-                                lbl,
-                                var_1,
-                                var_2,
-                                measure,
-                            )
-                        )
-
-            conn.commit()
+    # All repeats form one experiment, whose tasks are scheduled together.
+    try:
+        dirs = list(
+            map(
+                lambda d: os.path.join(input_root,d),
+                experiment['dirs']
+            )
+        )
+        exp = Experiment(
+            directories = dirs,
+            solver = experiment['solver'],
+            prob   = experiment['prob'],
+            config = experiment['config'],
+            poolsize = poolsize,
+            shardDir = shard_dir,
+            name     = experiment_name,
+            seed     = seed,
+            repeats  = repeat,
+            sweep    = sweep or experiment.get('sweep'),
+            sweepCount = sweep_count,
+        )
+        exp.skipTasks(finished)
+        cost = CostModel(times, exp.formulae)
+    except Exception as e:
+        print(
+            'Error: While initializing the experiment: {}.'
+            .format(e),
+            file=sys.stderr
+        )
+        sys.exit(1)
 
-            # Repeat
-            i += 1
+    repeats = sorted(set(task['repeat'] for task in exp.tasks))
+    if not repeats:
+        print(
+            'Experiment {}... already finished.'.format(experiment_name),
+            file=sys.stdout,
+            flush=True
+        )
+        sys.exit(0)
+
+    # Results are written in batches, optionally by a separate process.
+    # With a shard directory, every worker writes its own database there
+    # instead, to be merged with merge.py.
+    if shard_dir:
+        store = None
+    elif writer_process:
+        store = StoreWriter(outfile_path)
+    else:
+        store = ResultStore(outfile_path)
+    try:
+        # Run the experiment, and hand each result to the store as soon as
+        # it is finished; the store adds the experiment row of a repeat
+        # with its first result.
+        if store:
+            store.addExperiment(experiment_name, seed=seed)
+        try:
+            print(
+                'Experiment {}, {} tasks of {} repeats... '
+                .format(experiment_name, len(exp.tasks), len(repeats)),
+                file=sys.stdout,
+                end='',
+                flush=True
+            )
+            exp_begin = time.time()
+            for result in exp.streamExperiment(cost):
+                if store:
+                    store.addResult(result)
+            exp_end = time.time()
+            exp_dur = exp_end - exp_begin
+            print(
+                'done after {:10d} seconds.'.format(int(exp_dur)),
+                file=sys.stdout,
+                end='\n',
+                flush=True
+            )
+        except ValueError as e:
+            print(
+                'Error: While running the experiment: {}.'
+                .format(e),
+                file=sys.stderr
+            )
+            sys.exit(1)
+    finally:
+        if store:
+            store.close()
 
     sys.exit(0)
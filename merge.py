@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+from sat.store import mergeStores
+import sys
+import os
+import time
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    if len(sys.argv) <= 2:
+        print(
+            'Usage: merge.py <target.db> <source.db|shard directory>...',
+            file=sys.stderr
+        )
+        sys.exit(1)
+
+    target = sys.argv[1]
+
+    # Directories stand for all databases in them, like the shards of a run.
+    sources = []
+    for arg in sys.argv[2:]:
+        if os.path.isdir(arg):
+            sources += sorted(
+                os.path.join(arg, f)
+                for f in os.listdir(arg)
+                if f.endswith('.db')
+            )
+        else:
+            sources.append(arg)
+
+    if os.path.abspath(target) in map(os.path.abspath, sources):
+        print(
+            'Error: The target {} is also a source.'.format(target),
+            file=sys.stderr
+        )
+        sys.exit(1)
+
+    begin = time.time()
+    try:
+        mergeStores(target, sources)
+    except Exception as e:
+        print(
+            'Error: While merging: {}.'
+            .format(e),
+            file=sys.stderr
+        )
+        sys.exit(1)
+    print(
+        'Merged {} databases into {} after {:.1f} seconds.'
+        .format(len(sources), target, time.time() - begin)
+    )
+
+    sys.exit(0)
@@ -0,0 +1,361 @@
+from sat.utils import *
+from sat.prob_sat import ProbSAT
+import numpy as np
+import time
+
+
+class BatchProbSAT(ProbSAT):
+    """ Runs W independent probSAT walks on the same formula in lockstep,
+    with the state of all walks held in numpy arrays:
+
+        atoms      W x (n+1)  assignment of each walk
+        numTrueLit W x m      number of true literals per clause
+        trueXor    W x m      xor of the variables of the true literals per
+                              clause; equals the critical variable if
+                              numTrueLit is 1
+        breaks     W x (n+1)  break scores
+        falseLst   W x m      dense lists of the false clauses, the first
+                              numFalse[w] entries of row w are valid
+        falsePos   W x m      position of each false clause in falseLst
+        path       W x L      the variables flipped in the current try of
+                              each walk, the first pathLen[w] entries of
+                              row w are valid; L grows as needed
+
+    Every walk performs tries until it finds a model, or maxTries tries are
+    done, or the time limit is hit; each try produces a record in self.runs
+    like ProbSAT.solve does.
+    """
+
+    def __init__(self, formula, walks=100, **kwargs):
+        super().__init__(formula, **kwargs)
+
+        if not isinstance(self.formula, CompactCNF):
+            raise TypeError("formula = {} is no compact cnf-formula."
+                            .format(self.formula))
+        if type(walks) != int:
+            raise TypeError("walks={} is not of type int.".format(walks))
+        if walks <= 0:
+            raise ValueError("walks={} is not positive.".format(walks))
+        if self.windows:
+            raise ValueError("windows are not supported for batched walks.")
+        if self.trace:
+            raise ValueError("traces are not supported for batched walks.")
+
+        self.walks = walks
+
+
+    def initWalks(self, rows):
+        """ Start a new try in each walk of rows: draw random assignments,
+        and compute the true literal counts, break scores and false clauses.
+        """
+        n = self.formula.numVars
+        size = len(rows)
+
+        self.atoms[rows] = self.rng.integers(0, 2, (size, n+1), dtype=np.int8)
+        self.atoms[rows, 0] = 0
+        # truth[r, c, i]: is the i-th literal of clause c true in walk r?
+        truth = (self.atoms[rows][:, self.clauseVars] == self.clauseSigns) \
+            & self.clauseMask
+        self.numTrueLit[rows] = truth.sum(axis=2)
+        self.trueXor[rows] = np.bitwise_xor.reduce(
+            np.where(truth, self.clauseVars, 0),
+            axis=2,
+        )
+
+        self.breaks[rows] = 0
+        r, c = np.nonzero(self.numTrueLit[rows] == 1)
+        np.add.at(self.breaks, (rows[r], self.trueXor[rows[r], c]), 1)
+
+        r, c = np.nonzero(self.numTrueLit[rows] == 0)
+        counts = np.bincount(r, minlength=size)
+        starts = np.cumsum(counts) - counts
+        pos = np.arange(len(r)) - starts[r]
+        self.falseLst[rows[r], pos] = c
+        self.falsePos[rows[r], c] = pos
+        self.numFalse[rows] = counts
+
+        self.flip[rows] = 0
+        self.tries[rows] += 1
+        self.minUnsat[rows] = self.numFalse[rows]
+        self.lastUnsat[rows] = self.numFalse[rows]
+        self.minH[rows] = math.log(n, 2)
+        self.dist1[rows] = 0
+        self.pathLen[rows] = 0
+
+        self.window[rows] = 0
+        self.count[rows] = 0
+        self.entropy[rows] = 0
+        self.filled[rows] = 0
+        self.windowPos[rows] = 0
+
+        for w in rows:
+            self.record[w] = len(self.runs)
+            self.runs.append(dict(
+                flips                    = None,
+                minimal_unsat            = None,
+                last_unsat               = None,
+                min_h                    = None,
+                dist_1                   = None,
+                dist_2                   = None,
+            ))
+
+
+    def finishWalks(self, rows):
+        """ Write the state of the current tries of rows into their
+        records; the pairs of consecutive flips are counted from the path
+        of the try, once it is finished.
+        """
+        width = self.formula.numVars + 1
+        keyType = pairKeyType(width)
+        for w in rows:
+            record = self.runs[self.record[w]]
+            record['flips'] = int(self.flip[w])
+            record['minimal_unsat'] = int(self.minUnsat[w])
+            record['last_unsat'] = int(self.lastUnsat[w])
+            record['min_h'] = float(self.minH[w])
+            record['dist_1'] = self.dist1[w].astype(np.int32)
+            path = self.path[w, :self.pathLen[w]]
+            keys, counts = np.unique(
+                path[:-1].astype(keyType) * width + path[1:],
+                return_counts=True,
+            )
+            record['dist_2'] = (keys, counts.astype(np.int32))
+
+
+    def appendPath(self, rows, var):
+        """ Append the flipped variables var to the paths of rows, doubling
+        the width of the path buffer when it is full.
+        """
+        pos = self.pathLen[rows]
+        if pos.max() >= self.path.shape[1]:
+            self.path = np.concatenate(
+                (self.path, np.zeros_like(self.path)),
+                axis=1,
+            )
+        self.path[rows, pos] = var
+        self.pathLen[rows] = pos + 1
+
+
+    def occurrencePairs(self, literals):
+        """ For each literal, list the clauses it occurs in; return the
+        index of the literal and the clause of each such pair, grouped by
+        literal.
+        """
+        slots = literals + self.formula.numVars
+        starts = self.occurrenceOffsets[slots]
+        lengths = self.occurrenceOffsets[slots+1] - starts
+        group = np.repeat(np.arange(len(literals)), lengths)
+        # Position of each pair within its group.
+        rank = np.arange(len(group)) - (np.cumsum(lengths) - lengths)[group]
+        return group, self.occurrenceIndex[starts[group] + rank]
+
+
+    def removeFalse(self, walks, clauses):
+        """ Remove clauses[i] from the false list of walks[i], where the
+        pairs are grouped by walk. Each round removes at most one clause per
+        walk, so the swaps with the last entry of each list do not
+        interfere.
+        """
+        rank = np.arange(len(walks)) - np.searchsorted(walks, walks)
+        for j in range(0, int(rank.max()) + 1 if len(rank) > 0 else 0):
+            sel = rank == j
+            w = walks[sel]
+            c = clauses[sel]
+            pos = self.falsePos[w, c]
+            self.numFalse[w] -= 1
+            moved = self.falseLst[w, self.numFalse[w]]
+            self.falseLst[w, pos] = moved
+            self.falsePos[w, moved] = pos
+
+
+    def addFalse(self, walks, clauses):
+        """ Append clauses[i] to the false list of walks[i], where the pairs
+        are grouped by walk.
+        """
+        first = np.searchsorted(walks, walks)
+        pos = self.numFalse[walks] + np.arange(len(walks)) - first
+        self.falseLst[walks, pos] = clauses
+        self.falsePos[walks, clauses] = pos
+        np.add.at(self.numFalse, walks, 1)
+
+
+    def solve(self, seed):
+        self.rng = np.random.default_rng(seed)
+        formula = self.formula
+        n = formula.numVars
+        m = formula.numClauses
+        W = self.walks
+
+        clauses = formula.clauseMatrix()
+        self.clauseVars = np.abs(clauses)
+        self.clauseSigns = (clauses > 0).astype(np.int8)
+        self.clauseMask = clauses != 0
+        self.occurrenceOffsets = np.asarray(formula.occurrenceOffsets,
+                                            dtype=np.int64)
+        self.occurrenceIndex = np.asarray(formula.occurrenceIndex)
+        probs = np.array(self.probs, dtype=np.float64)
+
+        self.atoms = np.zeros((W, n+1), dtype=np.int8)
+        self.numTrueLit = np.zeros((W, m), dtype=np.int32)
+        self.trueXor = np.zeros((W, m), dtype=np.int32)
+        self.breaks = np.zeros((W, n+1), dtype=np.int32)
+        self.falseLst = np.zeros((W, m), dtype=np.int32)
+        self.falsePos = np.zeros((W, m), dtype=np.int32)
+        self.numFalse = np.zeros(W, dtype=np.int64)
+
+        self.flip = np.zeros(W, dtype=np.int64)
+        self.tries = np.zeros(W, dtype=np.int64)
+        self.minUnsat = np.zeros(W, dtype=np.int64)
+        self.lastUnsat = np.zeros(W, dtype=np.int64)
+        self.minH = np.zeros(W, dtype=np.float64)
+        self.dist1 = np.zeros((W, n+1), dtype=np.int64)
+        self.path = np.zeros((W, min(self.maxFlips, 1024)), dtype=np.int32)
+        self.pathLen = np.zeros(W, dtype=np.int64)
+        self.record = np.zeros(W, dtype=np.int64)
+
+        # Entropy tracking over a window of the last n/2 flips, as done by
+        # Entropytracker.
+        size = int(n/2)
+        h = np.zeros(size+2, dtype=np.float64)
+        for x in range(1, size+1):
+            p = x/size
+            h[x] = p*math.log(p, 2)
+        self.window = np.zeros((W, size), dtype=np.int64)
+        self.count = np.zeros((W, n+1), dtype=np.int64)
+        self.entropy = np.zeros(W, dtype=np.float64)
+        self.filled = np.zeros(W, dtype=np.int64)
+        self.windowPos = np.zeros(W, dtype=np.int64)
+
+        self.sat = False
+        active = np.ones(W, dtype=bool)
+        begin = time.time()
+
+        self.initWalks(np.arange(W))
+
+        while True:
+            if self.timeLimit and time.time() - begin > self.timeLimit:
+                break
+
+            rows = np.flatnonzero(active)
+            if len(rows) == 0:
+                break
+
+            self.flip[rows] += 1
+            unsat = self.numFalse[rows]
+            self.minUnsat[rows] = np.minimum(self.minUnsat[rows], unsat)
+            self.lastUnsat[rows] = unsat
+
+            # Walks with a model are done.
+            solved = unsat == 0
+            if solved.any():
+                self.sat = True
+                self.finishWalks(rows[solved])
+                active[rows[solved]] = False
+                rows = rows[~solved]
+                unsat = unsat[~solved]
+                if len(rows) == 0:
+                    continue
+            a = np.arange(len(rows))
+
+            # C_u <- randomly selected unsat clause
+            r = (self.rng.random(len(rows)) * unsat).astype(np.int64)
+            ci = self.falseLst[rows, r]
+
+            # var <- random variable x of C_u according to probability
+            #   f(x,a)/sum(x in C_u, f(x,a))
+            vs = self.clauseVars[ci]
+            ws = probs[self.breaks.reshape(-1)[rows[:, None]*(n+1) + vs]] \
+                * self.clauseMask[ci]
+            acc = np.cumsum(ws, axis=1)
+            u = self.rng.random(len(rows)) * acc[:, -1]
+            j = np.minimum((acc <= u[:, None]).sum(axis=1), vs.shape[1]-1)
+            var = vs[a, j]
+
+            # Flip statistics.
+            self.dist1[rows, var] += 1
+            self.appendPath(rows, var)
+
+            # Entropy window: drop the oldest flip if the window is filled,
+            # then add the new one.
+            full = self.filled[rows] >= size
+            if full.any():
+                fw = rows[full]
+                dropped = self.window[fw, self.windowPos[fw]]
+                c = self.count[fw, dropped]
+                self.entropy[fw] += h[c] - h[c-1]
+                self.count[fw, dropped] -= 1
+            c = self.count[rows, var]
+            self.entropy[rows] += h[c] - h[c+1]
+            self.count[rows, var] += 1
+            self.window[rows, self.windowPos[rows]] = var
+            self.windowPos[rows] = (self.windowPos[rows] + 1) % size
+            self.filled[rows] += 1
+            if full.any():
+                self.minH[fw] = np.minimum(self.minH[fw], self.entropy[fw])
+
+            # flip(var)
+            self.atoms[rows, var] ^= 1
+            satisfying = np.where(self.atoms[rows, var] == 1, var, -var)
+
+            # (walk, clause) pairs of the clauses containing the now
+            # satisfying, and the now falsifying literal.
+            sGroup, sClauses = self.occurrencePairs(satisfying)
+            fGroup, fClauses = self.occurrencePairs(-satisfying)
+            sFlat = rows[sGroup] * m + sClauses
+            fFlat = rows[fGroup] * m + fClauses
+            sVars = var[sGroup]
+            fVars = var[fGroup]
+
+            numTrueLit = self.numTrueLit.reshape(-1)
+            trueXor = self.trueXor.reshape(-1)
+            sTrue = numTrueLit[sFlat]
+            fTrue = numTrueLit[fFlat]
+            sXor = trueXor[sFlat]
+            fXor = trueXor[fFlat]
+
+            # Break score changes:
+            #   0 -> 1 true literals: var becomes critical
+            #   1 -> 2: the old critical variable is no longer
+            #   1 -> 0: var is no longer critical
+            #   2 -> 1: the remaining true literal becomes critical
+            becomeTrue = sTrue == 0
+            lostCrit = sTrue == 1
+            becomeFalse = fTrue == 1
+            newCrit = fTrue == 2
+            sBase = rows[sGroup] * (n+1)
+            fBase = rows[fGroup] * (n+1)
+            changed = np.concatenate((
+                sBase[becomeTrue] + sVars[becomeTrue],
+                sBase[lostCrit] + sXor[lostCrit],
+                fBase[becomeFalse] + fVars[becomeFalse],
+                fBase[newCrit] + (fXor[newCrit] ^ fVars[newCrit]),
+            ))
+            delta = np.ones(len(changed), dtype=np.int32)
+            delta[np.count_nonzero(becomeTrue):
+                  len(changed) - np.count_nonzero(newCrit)] = -1
+            np.add.at(self.breaks.reshape(-1), changed, delta)
+
+            numTrueLit[sFlat] += 1
+            trueXor[sFlat] ^= sVars
+            numTrueLit[fFlat] -= 1
+            trueXor[fFlat] ^= fVars
+
+            self.removeFalse(rows[sGroup[becomeTrue]], sClauses[becomeTrue])
+            self.addFalse(rows[fGroup[becomeFalse]], fClauses[becomeFalse])
+
+            # Walks which used up their flips restart, or are done.
+            exhausted = rows[self.flip[rows] >= self.maxFlips]
+            if len(exhausted) > 0:
+                self.finishWalks(exhausted)
+                restart = exhausted[self.tries[exhausted] < self.maxTries]
+                active[exhausted] = False
+                if len(restart) > 0 and not (
+                        self.timeLimit
+                        and time.time() - begin > self.timeLimit):
+                    self.initWalks(restart)
+                    active[restart] = True
+
+        self.finishWalks(np.flatnonzero(active))
+
+        end = time.time()
+        self.time = end-begin
@@ -0,0 +1,174 @@
+""" Columnar export of the experiment, algorithm_run and search_run tables:
+one .npy file per column, which are memory mapped for analysis.
+
+Layout: a directory per table, holding a file <column>.npy per column. The
+rows of algorithm_run are ordered by experiment, and those of search_run by
+algorithm run, so the rows of an experiment or an algorithm run are
+contiguous. The files offsets.npy of experiment and algorithm_run hold, per
+row, where its children begin, followed by the total count; experiment
+additionally holds searchOffsets.npy, the same for its search runs.
+
+NULLs, as in the rows and columns of databases from older versions, are
+exported as the value of nulls for the type of the column: NaN, -1 or ''.
+"""
+
+import os
+import sqlite3
+import numpy as np
+
+columns = {
+    'experiment': [
+        ('id',               np.int64),
+        ('experiment_name',  np.str_),
+        ('seed',             np.str_),
+        ('repetition',       np.int32),
+    ],
+    'algorithm_run': [
+        ('id',               np.int64),
+        ('experiment_id',    np.int64),
+        ('solver',           np.str_),
+        ('formula_fname',    np.str_),
+        ('max_clause_len',   np.int32),
+        ('variables',        np.int32),
+        ('clauses',          np.int32),
+        ('cb',               np.float64),
+        ('time',             np.float64),
+        ('sat',              np.bool_),
+    ],
+    'search_run': [
+        ('id',               np.int64),
+        ('algorithm_run_id', np.int64),
+        ('flips',            np.int64),
+        ('minimal_unsat',    np.int32),
+        ('last_unsat',       np.int32),
+        ('h_1',              np.float64),
+        ('h_2',              np.float64),
+        ('min_h',            np.float64),
+    ],
+}
+
+nulls = {
+    np.float64: float('nan'),
+    np.int32:   -1,
+    np.int64:   -1,
+    np.str_:    '',
+}
+
+queries = {
+    'experiment': """
+        SELECT {} FROM experiment
+        ORDER BY id
+    """,
+    'algorithm_run': """
+        SELECT {} FROM algorithm_run
+        WHERE experiment_id IN (SELECT id FROM experiment)
+        ORDER BY experiment_id, id
+    """,
+    'search_run': """
+        SELECT {} FROM search_run AS s
+        JOIN algorithm_run AS a ON s.algorithm_run_id = a.id
+        WHERE a.experiment_id IN (SELECT id FROM experiment)
+        ORDER BY a.experiment_id, a.id, s.id
+    """,
+}
+
+
+def offsets(parentIds, childRefs):
+    """ Where the children of each parent begin, and the total count, for
+    children ordered like their parents.
+    """
+    sorter = np.argsort(parentIds)
+    rows = sorter[np.searchsorted(parentIds, childRefs, sorter=sorter)]
+    counts = np.bincount(rows, minlength=len(parentIds))
+    return np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+
+def exportColumns(dbPath, directory):
+    """ Export the database at dbPath into directory, see above. """
+    data = {}
+    with sqlite3.connect(dbPath) as conn:
+        for table, cols in columns.items():
+            prefix = 's.' if table == 'search_run' else ''
+            present = set(
+                row[1] for row in conn.execute(
+                    'PRAGMA table_info({})'.format(table)
+                )
+            )
+            rows = conn.execute(queries[table].format(
+                ', '.join(prefix + name if name in present else 'NULL'
+                          for name, _ in cols)
+            )).fetchall()
+            values = list(zip(*rows)) if rows else [()]*len(cols)
+            data[table] = {
+                name: np.array(
+                    [nulls[dtype] if v is None else v for v in column]
+                    if dtype in nulls else column,
+                    dtype=dtype,
+                )
+                for (name, dtype), column in zip(cols, values)
+            }
+
+    experiment = data['experiment']
+    algorithmRun = data['algorithm_run']
+    searchRun = data['search_run']
+    experiment['offsets'] = offsets(experiment['id'],
+                                    algorithmRun['experiment_id'])
+    algorithmRun['offsets'] = offsets(algorithmRun['id'],
+                                      searchRun['algorithm_run_id'])
+    experiment['searchOffsets'] = \
+        algorithmRun['offsets'][experiment['offsets']]
+
+    for table, arrays in data.items():
+        os.makedirs(os.path.join(directory, table), exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, table, name + '.npy'), array)
+
+
+class ColumnStore:
+    """ Memory mapped columns of an export in directory. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+
+
+    def table(self, table):
+        """ The columns of table, as a dict of read-only memory maps. """
+        if table not in self.tables:
+            path = os.path.join(self.directory, table)
+            self.tables[table] = {
+                name[:-len('.npy')]: np.load(os.path.join(path, name),
+                                             mmap_mode='r')
+                for name in os.listdir(path)
+                if name.endswith('.npy')
+            }
+        return self.tables[table]
+
+
+    def experimentIndex(self, experimentId):
+        ids = self.table('experiment')['id']
+        idx = np.searchsorted(ids, experimentId)
+        if idx >= len(ids) or ids[idx] != experimentId:
+            raise KeyError('There is no experiment {}.'.format(experimentId))
+        return idx
+
+
+    def algorithmRuns(self, experimentId):
+        """ The algorithm_run columns of an experiment, as slices. """
+        idx = self.experimentIndex(experimentId)
+        lo, hi = self.table('experiment')['offsets'][idx:idx+2]
+        return {name: col[lo:hi]
+                for name, col in self.table('algorithm_run').items()
+                if name != 'offsets'}
+
+
+    def searchRuns(self, experimentId=None):
+        """ The search_run columns of an experiment, or of all experiments,
+        as slices.
+        """
+        runs = self.table('search_run')
+        if experimentId == None:
+            return dict(runs)
+        idx = self.experimentIndex(experimentId)
+        lo, hi = self.table('experiment')['searchOffsets'][idx:idx+2]
+        return {name: col[lo:hi] for name, col in runs.items()}
@@ -0,0 +1,188 @@
+""" Compiled formulae: a binary image of a CompactCNF (literals, clause
+offsets, occurrence index and metadata), which is memory mapped instead of
+parsing the DIMACS file again.
+
+Layout: a fixed header (see 'header'), followed by the int32 arrays
+literals, clauseOffsets, occurrenceIndex and occurrenceOffsets, followed by
+the utf-8 encoded comments.
+"""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+from sat.utils import CompactCNF
+
+MAGIC = b'CNFC'
+VERSION = 1
+EXTENSION = '.cnfc'
+
+header = np.dtype([
+    ('magic',             'S4'),
+    ('version',           '<u4'),
+    ('sourceSize',        '<i8'),
+    ('sourceMtime',       '<i8'),
+    ('sourceHash',        'u1', (20,)),
+    ('pad',               'S4'),
+    ('numVars',           '<i8'),
+    ('numClauses',        '<i8'),
+    ('maxClauseLength',   '<i8'),
+    ('maxOccs',           '<i8'),
+    ('numLiterals',       '<i8'),
+    ('commentBytes',      '<i8'),
+])
+
+
+def hashFile(filepath):
+    with open(filepath, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def compiledPath(filepath, cacheDir=None, sourceHash=None):
+    """ The path of the compiled image of filepath: a sidecar next to the
+    file, or, if a cache directory is given, a file in it named by the
+    content hash of the formula.
+    """
+    if cacheDir == None:
+        return filepath + EXTENSION
+    if sourceHash == None:
+        sourceHash = hashFile(filepath)
+    return os.path.join(cacheDir, sourceHash.hex() + EXTENSION)
+
+
+def writeCompiled(formula, path, sourceStat, sourceHash):
+    """ Write the compiled image of formula to path. The file is written
+    to a temporary file first, and then moved into place, so concurrent
+    workers never see a partial image.
+    """
+    formula.checkInit()
+
+    comments = ''.join(formula.comments).encode()
+    head = np.zeros(1, dtype=header)
+    head['magic'] = MAGIC
+    head['version'] = VERSION
+    head['sourceSize'] = sourceStat.st_size
+    head['sourceMtime'] = sourceStat.st_mtime_ns
+    head['sourceHash'] = np.frombuffer(sourceHash, dtype=np.uint8)
+    head['numVars'] = formula.numVars
+    head['numClauses'] = formula.numClauses
+    head['maxClauseLength'] = formula.maxClauseLength
+    head['maxOccs'] = formula.maxOccs
+    head['numLiterals'] = len(formula.literals)
+    head['commentBytes'] = len(comments)
+
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=EXTENSION + '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head.tobytes())
+            for buf in (formula.literals,
+                        formula.clauseOffsets,
+                        formula.occurrenceIndex,
+                        formula.occurrenceOffsets):
+                f.write(np.ascontiguousarray(buf, dtype='<i4').tobytes())
+            f.write(comments)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def readCompiled(path):
+    """ Memory map the compiled image at path, and return the header and
+    a CompactCNF whose buffers are views into the mapping.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    head = data[:header.itemsize].view(header)[0]
+    if head['magic'] != MAGIC or head['version'] != VERSION:
+        raise ValueError('{} is no compiled formula of version {}.'
+                         .format(path, VERSION))
+
+    numVars = int(head['numVars'])
+    numClauses = int(head['numClauses'])
+    numLiterals = int(head['numLiterals'])
+    sizes = (numLiterals, numClauses+1, numLiterals, 2*numVars+2)
+    end = header.itemsize + 4*sum(sizes)
+    ints = data[header.itemsize:end].view('<i4')
+
+    begin = 0
+    buffers = []
+    for size in sizes:
+        buffers.append(ints[begin:begin+size])
+        begin += size
+    comments = data[end:].tobytes().decode()
+
+    formula = CompactCNF()
+    formula.numVars = numVars
+    formula.comments = comments.splitlines(keepends=True)
+    formula.initFromIndex(*buffers)
+    return head, formula
+
+
+def loadFormula(filepath, cacheDir=None):
+    """ Load the formula at filepath from its compiled image, if there is a
+    valid one, and otherwise parse it and write the compiled image.
+
+    A sidecar image is valid if the size and modification time of the
+    formula did not change, or, if they did, its content hash is still the
+    same. A cache directory is keyed by the content hash itself.
+    If the image cannot be written, the parsed formula is returned anyway.
+    """
+    stat = os.stat(filepath)
+    sourceHash = None
+    if cacheDir != None:
+        os.makedirs(cacheDir, exist_ok=True)
+        sourceHash = hashFile(filepath)
+    path = compiledPath(filepath, cacheDir, sourceHash)
+
+    if os.path.exists(path):
+        try:
+            head, formula = readCompiled(path)
+            if cacheDir != None \
+                    or (head['sourceSize'] == stat.st_size
+                        and head['sourceMtime'] == stat.st_mtime_ns):
+                return formula
+            sourceHash = hashFile(filepath)
+            if head['sourceHash'].tobytes() == sourceHash:
+                return formula
+        except ValueError:
+            pass
+
+    formula = CompactCNF(filepath)
+    if sourceHash == None:
+        sourceHash = hashFile(filepath)
+    try:
+        writeCompiled(formula, path, stat, sourceHash)
+    except OSError:
+        pass
+    return formula
+
+
+def readFormula(filepath, formulaCache=None):
+    """ Read the formula at filepath: parse it, or, if formulaCache is
+    True, load it from a sidecar image, or, if formulaCache is a string,
+    from an image in that cache directory.
+    """
+    if formulaCache == None:
+        return CompactCNF(filepath)
+    elif formulaCache is True:
+        return loadFormula(filepath)
+    elif type(formulaCache) == str:
+        return loadFormula(filepath, cacheDir=formulaCache)
+    else:
+        raise TypeError("formulaCache={} is neither True nor a string."
+                        .format(formulaCache))
+
+
+def formulaBytes(formula):
+    """ An estimate of the memory held by formula. """
+    if isinstance(formula, CompactCNF):
+        size = sum(buf.nbytes for buf in (formula.literals,
+                                          formula.clauseOffsets,
+                                          formula.occurrenceIndex,
+                                          formula.occurrenceOffsets))
+        if formula._clauseMatrix is not None:
+            size += formula._clauseMatrix.nbytes
+        return size
+    # Lists of lists of ints: about 36 bytes per literal, twice.
+    return 72 * formula.numClauses * formula.maxClauseLength
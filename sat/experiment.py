@@ -3,11 +3,218 @@ import sys
 import time
 import random
 import json
+import socket
+import itertools
 from io import IOBase
-from sat.utils import CNF
+from collections import OrderedDict
+from sat.utils import CNF, CompactCNF, summarizeRun, packRuns, unpackRuns
+from sat.store import ResultStore, taskKey
+from sat.compiled import readFormula, formulaBytes
 from multiprocessing import Pool
 
 
+# The shard store of this worker process, see runTask.
+_shardStore = None
+
+def shardStore(directory, name, seed):
+    """ The result store of this process in directory, created on first
+    use, for the experiment name run with seed.
+    """
+    global _shardStore
+    if _shardStore == None:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory,
+            '{}-{}-{}.db'.format(name, socket.gethostname(), os.getpid())
+        )
+        # Pool workers are terminated without cleanup, so every result is
+        # written right away, and without a WAL file left behind.
+        _shardStore = ResultStore(path, batchSize=1, wal=False)
+    _shardStore.addExperiment(name, seed=seed)
+    return _shardStore
+
+
+class FormulaCache:
+    """ A least recently used cache of parsed formulae, keyed by path and
+    formulaCache option, which holds at most maxBytes of formulae.
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.formulae = OrderedDict()
+
+
+    def get(self, filepath, formulaCache=None):
+        key = (filepath, formulaCache)
+        if key in self.formulae:
+            self.formulae.move_to_end(key)
+            return self.formulae[key][0]
+
+        formula = readFormula(filepath, formulaCache)
+        # The solvers build the clause matrix of the formula, which is
+        # cached with it (see ArrayBreakscore), so it is counted as well.
+        if isinstance(formula, CompactCNF):
+            formula.clauseMatrix()
+        size = formulaBytes(formula)
+        self.formulae[key] = (formula, size)
+        self.bytes += size
+        while self.bytes > self.maxBytes and len(self.formulae) > 1:
+            _, (_, size) = self.formulae.popitem(last=False)
+            self.bytes -= size
+        return formula
+
+
+# The formula cache of this worker process, see runTask.
+_formulaCache = None
+
+def cachedFormula(filepath, formulaCache, maxBytes):
+    global _formulaCache
+    if _formulaCache == None:
+        _formulaCache = FormulaCache(maxBytes)
+    return _formulaCache.get(filepath, formulaCache)
+
+
+def formulaHeader(filepath):
+    """ The number of variables and clauses, from the p line of the
+    DIMACS file at filepath.
+    """
+    with open(filepath) as f:
+        for line in f:
+            if line[0] == 'p':
+                n, m = line.split()[2:4]
+                return int(n), int(m)
+    raise ValueError('{} has no p line.'.format(filepath))
+
+
+class CostModel:
+    """ The expected run times of tasks: the mean stored time of the
+    formula at the cb of the task, where known, else the mean stored time
+    of the formula over all cbs, and otherwise an estimate from the size
+    and the clause/variable ratio of the formula, scaled to the stored
+    times of the other formulae. times maps (formula, cb) to a mean time;
+    see runTimes.
+    """
+
+    def __init__(self, times=None, formulae=()):
+        self.times = times or {}
+        byFormula = {}
+        for (filepath, _), time in self.times.items():
+            byFormula.setdefault(filepath, []).append(time)
+        self.formulaTimes = {
+            filepath: sum(times) / len(times)
+            for filepath, times in byFormula.items()
+        }
+        self.estimates = {}
+        known = [f for f in set(formulae) if f in self.formulaTimes]
+        estimated = sum(self.estimate(f) for f in known)
+        if estimated > 0:
+            self.scale = sum(self.formulaTimes[f] for f in known) / estimated
+        else:
+            self.scale = 1.0
+
+
+    def estimate(self, filepath):
+        if filepath not in self.estimates:
+            n, m = formulaHeader(filepath)
+            # The number of clauses times the clause/variable ratio:
+            # larger formulae take longer, and denser ones, towards the
+            # threshold, are harder.
+            self.estimates[filepath] = m * m / max(n, 1)
+        return self.estimates[filepath]
+
+
+    def __call__(self, task):
+        filepath = task['formula']
+        key = (filepath, task['config'].get('cb'))
+        if key in self.times:
+            cost = self.times[key]
+        elif filepath in self.formulaTimes:
+            cost = self.formulaTimes[filepath]
+        else:
+            cost = self.scale * self.estimate(filepath)
+        return cost
+
+
+def runJob(job):
+    """ Run a job in a pool worker: the settings (solver, shardDir, name,
+    seed, formulaCacheBytes) of an experiment, and a list of task descriptors;
+    see Experiment.jobs. Returns the list of compact results.
+    """
+    settings, tasks = job
+    return [runTask(settings, task) for task in tasks]
+
+
+# The last solver of this worker process, and its key, see taskSolver.
+_lastSolver = None
+
+def taskSolver(settings, task):
+    """ A solver for task. The last solver of this worker is reused, if it
+    ran the same formula with a config that differs in cb only; its probs
+    are rebuilt by setCB. So the points of a sweep share a solver, as long
+    as they are run by the same worker one after another.
+    """
+    global _lastSolver
+    cb = task['config'].get('cb')
+    key = (
+        settings[0],
+        task['formula'],
+        {k: v for k,v in task['config'].items() if k != 'cb'},
+    )
+    if _lastSolver != None and _lastSolver[0] == key and type(cb) == float:
+        solver = _lastSolver[1]
+        solver.setCB(cb)
+        solver.runs = []
+    else:
+        solver = newSolver(settings, task)
+        _lastSolver = (key, solver)
+    return solver
+
+
+def newSolver(settings, task):
+    solverClass, _, _, _, formulaCacheBytes = settings
+    # Parse every formula once per worker; the solvers share it.
+    formula = cachedFormula(
+        task['formula'],
+        task['config'].get('formulaCache'),
+        formulaCacheBytes,
+    )
+    return solverClass(formula,
+                       formulaFname=task['formula'],
+                       **task['config'])
+
+
+def runTask(settings, task):
+    """ Run a task, and return its result: the scalars of the algorithm
+    run, and its runs summarized and packed by packRuns.
+    """
+    _, shardDir, name, seed, _ = settings
+    solver = taskSolver(settings, task)
+    solver.solve(task['seed'])
+    # Summarize the flip distributions here, in the worker, so only
+    # scalars are sent back.
+    for run in solver.runs:
+        summarizeRun(run, solver.formula.numVars)
+    runs, windows, traces = packRuns(solver.runs)
+    result = dict(
+        formula_fname = solver.formula_fname,
+        max_clause_len = solver.formula.maxClauseLength,
+        variables   = solver.formula.numVars,
+        clauses     = solver.formula.numClauses,
+        cb          = solver.cb,
+        time        = solver.time,
+        runs        = runs,
+        windows     = windows,
+        traces      = traces,
+        sat         = solver.sat,
+        task        = task,
+    )
+    if shardDir:
+        shardStore(shardDir, name, seed).addResult(result)
+        del result['runs'], result['windows'], result['traces']
+    return result
+
+
 class Experiment:
     # TODO needs overhaul!!!
 
@@ -19,7 +226,15 @@ class Experiment:
                  verbose  = False,
                  seed     = None,
                  prob     = None,
-                 log      = sys.stdout):
+                 log      = sys.stdout,
+                 shardDir = None,
+                 name     = None,
+                 repeat   = 0,
+                 pool     = None,
+                 formulaCacheBytes = 256 << 20,
+                 sweep    = None,
+                 sweepCount = 1,
+                 repeats  = 1):
 
         if type(prob) is not int:
             raise ValueError(
@@ -28,16 +243,41 @@ class Experiment:
 
         self.verbose=verbose
         self.log=log
+        # With a seed, the choice of formulae, configurations and solver
+        # seeds is reproducible, so a rerun yields the same tasks.
+        self.seed = seed
+        self.random = random
+        self.prob = prob
         self.setupFormulae(prob, directories)
         self.poolsize = poolsize
         self.config = config
-        self.seed = None
+        # The tasks of the repeats repeat, ..., repeat+repeats-1.
+        self.repeat = repeat
+        self.repeats = repeats
+        # With sweep, a list of config keys, or a dict of keys and the
+        # values to use, there is a task per formula and point of the grid
+        # of these values, sweepCount times.
+        if sweep != None and type(sweep) not in (list, tuple, dict):
+            raise TypeError('sweep={} should be a list or a dict.'
+                            .format(sweep))
+        self.sweep = sweep
+        self.sweepCount = sweepCount
+        self.setupTasks()
         if solver:
             self.solver=solver
             self.ready=True
         else:
             self.ready=False
         self.executed = False
+        # With shardDir, the workers write their results to their own
+        # stores in shardDir, and only return their headers.
+        self.shardDir = shardDir
+        self.name = name
+        # An external pool is reused, so its workers keep their formula
+        # caches across experiments. Workers only receive the jobs, see
+        # runJob, never the experiment itself.
+        self.pool = pool
+        self.formulaCacheBytes = formulaCacheBytes
 
 
     def setupSolvers(self, solver, config = dict()):
@@ -77,27 +317,21 @@ class Experiment:
         #   os.listdir directory
         #   >>> filter (\f -> f.endswith('.cnf'))
         #   >>> map CNF
-        self.formulae = []
+        self.allFormulae = []
         for directory in directories:
-            self.formulae += list(
+            self.allFormulae += list(
                 map(
                     lambda f: os.path.join(directory, f),
                     filter(
                         lambda f: f.endswith('.cnf'),
-                        os.listdir(directory)
+                        sorted(os.listdir(directory))
                     )
                 )
             )
 
-        self.formulae = random.sample(
-            self.formulae,
-            prob
-        )
-
-
         # Raise a waring, if the directory is empty,
         # and no output is to be expected.
-        if len(self.formulae) <= 0:
+        if len(self.allFormulae) <= 0 or prob <= 0:
             raise RuntimeWarning(
                 'There are no test files: there will be no output.')
 
@@ -107,29 +341,118 @@ class Experiment:
                   file=self.log)
 
 
-    def _runSolver(self, filepath):
-        def prepare_config():
-            empty_config = {}
-            for k,v in self.config.items():
-                if type(v) is list:
-                    empty_config[k] = v[random.randrange(0,len(v))]
-                else:
-                    empty_config[k] = v
-            return empty_config
+    def sweepGrid(self):
+        """ The points of the sweep grid, as dicts of config values, in a
+        fixed order.
+        """
+        if type(self.sweep) is dict:
+            values = self.sweep
+        else:
+            values = {}
+            for k in self.sweep:
+                v = self.config[k]
+                values[k] = v if type(v) is list else [v]
+        keys = sorted(values)
+        return [dict(zip(keys, point))
+                for point in itertools.product(*(values[k] for k in keys))]
 
-        solver = self.solver(filepath,**prepare_config())
-        solver.solve(self.seed)
+
+    def newTask(self, filepath, config, repeat):
         return dict(
-            formula_fname = solver.formula_fname,
-            max_clause_len = solver.formula.maxClauseLength,
-            variables   = solver.formula.numVars,
-            clauses     = solver.formula.numClauses,
-            cb          = solver.cb,
-            time        = solver.time,
-            runs        = solver.runs,
-            sat         = solver.sat,
+            formula = filepath,
+            config  = config,
+            seed    = (self.random.randrange(2**31)
+                       if self.seed != None else None),
+            repeat  = repeat,
         )
 
+
+    # Config options whose values are lists themselves, rather than lists
+    # of values to choose from.
+    listOptions = ('windows',)
+
+    def setupTasks(self):
+        """ One task per formula of the sample of each repeat, with its
+        configuration, where list values are chosen randomly (except for
+        listOptions), and its solver seed. In a sweep, there is a task per
+        formula and grid point instead, see sweepGrid.
+        """
+        swept = set(self.sweep or ())
+        grid = self.sweepGrid() if self.sweep else None
+        self.tasks = []
+        self.formulae = []
+        for repeat in range(self.repeat, self.repeat + self.repeats):
+            self.setupRepeat(repeat, swept, grid)
+
+
+    def setupRepeat(self, repeat, swept, grid):
+        if self.seed != None:
+            self.random = random.Random('{}:{}'.format(self.seed, repeat))
+        formulae = self.random.sample(self.allFormulae, self.prob)
+        self.formulae += formulae
+        for filepath in formulae:
+            config = {}
+            for k,v in self.config.items():
+                if k in swept:
+                    continue
+                if type(v) is list and k not in Experiment.listOptions:
+                    config[k] = v[self.random.randrange(0,len(v))]
+                else:
+                    config[k] = v
+            if grid == None:
+                self.tasks.append(self.newTask(filepath, config, repeat))
+            else:
+                # The points of a formula are consecutive tasks, so a
+                # worker running several of them can share a solver, see
+                # taskSolver.
+                self.tasks += [self.newTask(filepath,
+                                            dict(config, **point),
+                                            repeat)
+                               for point in grid
+                               for _ in range(self.sweepCount)]
+
+
+    def skipTasks(self, finished):
+        """ Drop the tasks whose keys (see taskKey) are in finished. """
+        self.tasks = [task for task in self.tasks
+                      if taskKey(task) not in finished]
+
+
+    def taskGroups(self):
+        """ The tasks, grouped by formula, so a worker runs all tasks of a
+        formula it holds; groups are split to keep every worker busy.
+        """
+        groups = OrderedDict()
+        for task in self.tasks:
+            groups.setdefault(task['formula'], []).append(task)
+        size = max(1, -(-len(self.tasks) // self.poolsize))
+        return [group[i:i+size]
+                for group in groups.values()
+                for i in range(0, len(group), size)]
+
+
+    def jobs(self, cost=None):
+        """ The jobs for runJob: the worker settings, and groups of tasks
+        (see taskGroups), or, with cost, a function of tasks, single tasks,
+        those of highest cost first, so no worker is left with a long task
+        at the end. Tasks of equal cost are ordered by formula, so the tasks
+        of a formula stay consecutive, and the workers taking them from the
+        queue mostly find the formula in their caches, or their last
+        solver (see taskSolver).
+        """
+        settings = (self.solver, self.shardDir, self.name, self.seed,
+                    self.formulaCacheBytes)
+        if cost == None:
+            groups = self.taskGroups()
+        else:
+            groups = [[task]
+                      for task in sorted(
+                          self.tasks,
+                          key=lambda task: (-cost(task), task['formula'])
+                      )]
+        return [(settings, group) for group in groups]
+
+
     def runExperiment(self):
         if self.verbose:
             print('Running Solvers... ',
@@ -144,13 +467,61 @@ class Experiment:
 
 
 
-        with Pool(processes=self.poolsize) as pool:
-            log = self.log
-            del self.log
-            begin = time.time()
-            self.results = pool.map(self._runSolver, self.formulae)
-            end = time.time()
-            self.log = log
+        pool = self.pool or Pool(processes=self.poolsize)
+        begin = time.time()
+        try:
+            self.results = [
+                result
+                for results in pool.map(runJob, self.jobs())
+                for result in results
+            ]
+        finally:
+            if not self.pool:
+                pool.terminate()
+        end = time.time()
+
+        totalSecs = int(end - begin)
+        secs = totalSecs % 60
+        mins = (totalSecs // 60) % 60
+        hours = totalSecs // (60*60)
+
+
+        if self.verbose:
+            print(' ...solvers run; took {}h{}m{}s'.format(hours, mins, secs),
+                  file=self.log,
+                  flush=True)
+
+        self.executed = True
+
+
+    def streamExperiment(self, cost=None):
+        """ Run the solvers like runExperiment, but yield the results in the
+        order they are finished, instead of collecting them in
+        self.results. With cost, the tasks are sent one by one, see jobs.
+        """
+        if self.verbose:
+            print('Running Solvers... ',
+                  file=self.log,
+                  flush=True)
+
+        if not self.ready:
+            raise RuntimeError('First run prepareSolvers.')
+
+        if self.executed:
+            raise RuntimeWarning('Experiment already run!')
+
+        pool = self.pool or Pool(processes=self.poolsize)
+        begin = time.time()
+        try:
+            for results in pool.imap_unordered(runJob,
+                                               self.jobs(cost),
+                                               chunksize=1):
+                for result in results:
+                    yield result
+        finally:
+            if not self.pool:
+                pool.terminate()
+        end = time.time()
 
         totalSecs = int(end - begin)
         secs = totalSecs % 60
@@ -246,6 +617,8 @@ class Experiment:
                 json.dumps(
                     res if res else self.results,
                     indent=2,
+                    # The packed runs of the results, see packRuns.
+                    default=unpackRuns,
                 )
             )
 
@@ -1,7 +1,11 @@
 from sat.utils import *
+from sat.compiled import readFormula
+from sat.trace import openTrace
+from collections import defaultdict
+import numpy as np
 import time
 import sys
-import random
+import os
 
 class ProbSAT:
     # TODO needs overhaul!!!
@@ -32,6 +36,20 @@ class ProbSAT:
                              .format(self.func))
 
 
+    def setCB(self, cb):
+        """ Change cb for the following solves, e.g. in a sweep over cb
+        values; the formula, its index and the walk structures are kept,
+        and only the probs table is rebuilt.
+        """
+        if type(cb) != float:
+            raise TypeError("cb={} is not of type float.".format(cb))
+        self.cb = cb
+        self.initProbs()
+        if self.scoreboard != None:
+            # The next initWalk recomputes the weights from the new table.
+            self.scoreboard.probs = self.probs
+
+
     def __init__(self,
                  formula,
                  cb=None,
@@ -39,11 +57,20 @@ class ProbSAT:
                  maxTries=None,
                  timeLimit=None,
                  func=None,
-                 seed=None):
+                 seed=None,
+                 formulaCache=None,
+                 windows=None,
+                 trace=None,
+                 traceUnsat=False,
+                 formulaFname=None):
         if isinstance(formula, CNF):
+            # A preloaded formula; formulaFname names its file.
             self.formula = formula
+            self.formula_fname = formulaFname
         elif type(formula) == str:
-            self.formula = CNF(formula)
+            # formulaCache is either True, for compiled images next to the
+            # formulae, or a cache directory.
+            self.formula = readFormula(formula, formulaCache)
             self.formula_fname = formula
         else:
             raise TypeError("formula = {} is neither a cnf-formula nor a string"
@@ -89,6 +116,31 @@ class ProbSAT:
             raise TypeError("cb={} is not of type float."
                             .format(cb))
 
+        # Additional entropy windows, as factors of numVars.
+        if windows == None:
+            self.windows = None
+        elif type(windows) in (list, tuple):
+            self.windows = [max(1, int(w*self.formula.numVars))
+                            for w in windows]
+        else:
+            raise TypeError("windows={} is neither a list nor a tuple."
+                            .format(windows))
+
+        # Flip traces are written to files in the directory trace, named
+        # after the formula.
+        if trace == None:
+            self.trace = None
+        elif type(trace) == str:
+            self.trace = trace
+            if self.formula_fname:
+                self.traceName = os.path.splitext(
+                    os.path.basename(self.formula_fname))[0]
+            else:
+                self.traceName = 'formula'
+        else:
+            raise TypeError("trace={} is not a string.".format(trace))
+        self.traceUnsat = traceUnsat
+
         self.eps = 0.9
         self.initProbs()
         self.flips = 0
@@ -97,45 +149,85 @@ class ProbSAT:
         self.result = None
         self.sat=None
         self.assignment = None
+        self.scoreboard = None
 
         self.maxEntropy=math.log(self.formula.numVars, 2)
 
         self.seed = seed
+        self.stream = None
         self.runs = []
 
 
+    # Up to this many entries, pair counts are kept in a dense list instead
+    # of a dict.
+    denseDistLimit = 4096
+
+    def initDists(self):
+        """ Fresh flip counters for a run: a count list indexed by variable,
+        and pair counts indexed by last_var*(numVars+1)+var.
+        """
+        width = self.formula.numVars+1
+        dist1 = [0]*width
+        if width*width <= ProbSAT.denseDistLimit:
+            dist2 = [0]*(width*width)
+        else:
+            dist2 = defaultdict(int)
+        return dist1, dist2
+
+
+    def finishDists(self, record, dist1, dist2):
+        """ Store the flip counters of a run compactly: dist_1 as an int32
+        array of counts indexed by variable, dist_2 as a pair of sorted
+        arrays of pair keys (see decodePairKeys) and their counts.
+        """
+        width = self.formula.numVars+1
+        record['dist_1'] = np.array(dist1, dtype=np.int32)
+        if type(dist2) == list:
+            counts = np.array(dist2, dtype=np.int32)
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys = np.fromiter(dist2.keys(), dtype=np.int64, count=len(dist2))
+            counts = np.fromiter(dist2.values(), dtype=np.int32,
+                                 count=len(dist2))
+            order = np.argsort(keys)
+            keys = keys[order]
+            counts = counts[order]
+        # Keys below width count the first flip of the run, which has no
+        # predecessor.
+        keep = keys >= width
+        record['dist_2'] = (keys[keep].astype(pairKeyType(width)), counts[keep])
+
+
     def initWalk(self):
+        # Restarts reuse the structures of the first try: draw a new
+        # assignment in place, and recompute the scoreboard from it.
+        if self.scoreboard != None:
+            self.assignment.initRandomly(self.stream)
+            self.scoreboard.reset()
+            return
+
         # Init empty list of false clauses
-        self.falseClauses = Falselist()
+        self.falseClauses = ArrayFalselist(self.formula.numClauses)
         # Init random assignment
-        self.assignment   = Assignment(
+        self.assignment   = TruthAssignment(
             atoms=None,
             varCount = self.formula.numVars,
+            stream = self.stream,
         )
         # Init break scoreboard
-        self.scoreboard   = Breakscore(self.formula,
-                                       self.assignment,
-                                       self.falseClauses)
+        self.scoreboard   = ArrayBreakscore(self.formula,
+                                            self.assignment,
+                                            self.falseClauses,
+                                            self.probs)
 
     def __call__(self):
         self.solve(self.seed)
 
 
     def solve(self, seed):
-        def choose(seq, weights):
-            s = sum(weights)
-            acc = s
-
-            r = random.random() * s
-            for i in range(0,len(weights)):
-                t = seq[i]
-                acc -= weights[i]
-                if r >= acc:
-                    break
-
-            return t
-
-        random.seed(seed)
+        self.stream = RandomStream(seed)
+        nextRandom = self.stream.random
 
         begin = time.time()
 
@@ -158,11 +250,31 @@ class ProbSAT:
                 minimal_unsat            = None,
                 last_unsat               = None,
                 min_h                    = math.log(self.formula.numVars,2),
-                dist_1                   = {},
-                dist_2                   = {},
+                dist_1                   = None,
+                dist_2                   = None,
             )
+            dist1, dist2 = self.initDists()
+            width = self.formula.numVars+1
+            if self.windows:
+                windows = MultiEntropytracker(
+                    self.windows,
+                    self.formula.numVars
+                )
+                # [window size, min_h, flip of min_h] per window
+                record['min_h_windows'] = windows.minima
+            traceAdd = None
+            if self.trace:
+                traceWriter = openTrace(
+                    self.trace,
+                    self.traceName,
+                    self.formula.numVars,
+                    self.formula.numClauses,
+                    withUnsat = self.traceUnsat,
+                )
+                traceAdd = traceWriter.add
+                record['trace'] = traceWriter.path
             self.runs.append(record)
-            last_var = None
+            last_var = 0
             for f in range(1, self.maxFlips+1):
                 unsat = len(self.falseClauses)
                 if unsat < minUnsat:
@@ -175,46 +287,50 @@ class ProbSAT:
                 # if (a is model for F) then
                 #   return a
                 if unsat == 0:
+                    self.finishDists(record, dist1, dist2)
+                    if traceAdd:
+                        traceWriter.close()
                     end = time.time()
                     self.time = end-begin
                     self.sat = True
                     return
 
                 # C_u <- randomly selected unsat clause
-                ci  = self.falseClauses.lst[random.randint(0, unsat-1)]
+                ci  = self.falseClauses.pick(nextRandom())
                 c   = self.formula.clauses[ci]
 
-                # for x in C_u do
-                #   compute f(x,a)
-                ws  = [self.probs[self.scoreboard.getBreakScore(abs(lit))]
-                       for lit in c]
-
                 # var <- random variable x according to probability
-                #   f(x,a)/sum(x in C_u, f(x,a))
-                var = abs(choose(c, ws))
+                #   f(x,a)/sum(x in C_u, f(x,a)),
+                # where the scoreboard keeps f(x,a) per literal.
+                weights = self.scoreboard.weights
+                acc = 0
+                for lit in c:
+                    acc += weights[lit]
+                r = nextRandom() * acc
+                for lit in c:
+                    acc -= weights[lit]
+                    if r >= acc:
+                        break
+                var = abs(lit)
                 filled = tracker.add(var)
                 if filled:
                     record['min_h'] = min(tracker.getEntropy(),record['min_h'])
-                if var in record['dist_1']:
-                    record['dist_1'][var] += 1
-                else:
-                    record['dist_1'][var] = 1
-
-                if last_var:
-                    if (last_var, var) in record['dist_2']:
-                        record['dist_2'][(last_var, var)] += 1
-                    else:
-                        record['dist_2'][(last_var, var)] = 1
-
+                if self.windows:
+                    windows.add(var)
+                dist1[var] += 1
+                # With last_var = 0, the first flip lands below width, and
+                # is dropped by finishDists.
+                dist2[last_var*width + var] += 1
                 last_var = var
+                if traceAdd:
+                    traceAdd(var, unsat)
 
                 # flip(var)
-                self.scoreboard.flip(
-                    var,
-                    self.formula,
-                    self.assignment,
-                    self.falseClauses
-                )
+                self.scoreboard.flip(var)
+
+            self.finishDists(record, dist1, dist2)
+            if traceAdd:
+                traceWriter.close()
 
 
         end = time.time()
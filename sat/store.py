@@ -0,0 +1,733 @@
+""" Storage of experiment results in an SQLite database.
+
+A ResultStore buffers the rows of finished results, and writes them in
+batches with executemany. Row IDs are assigned by the store itself, so the
+rows of child tables can be buffered along with their parents; they are
+reserved when the rows are written, so several stores can write to the
+same database. A StoreWriter runs a ResultStore in a separate process, fed
+by a queue.
+"""
+
+import os
+import time
+import json
+import sqlite3
+from multiprocessing import Process, Queue
+from sat.utils import measureLabels
+
+
+# Config options which do not change the results of a task, and are left
+# out of its key, so they can differ between a run and its resumption.
+runOptions = ('formulaCache', 'trace', 'traceUnsat')
+
+
+def configKey(config):
+    return json.dumps(
+        {k: v for k,v in config.items() if k not in runOptions},
+        sort_keys=True,
+        default=str,
+    )
+
+
+def taskKey(task):
+    """ The key of a task: formula, configuration, seed and repeat. """
+    return (
+        task['formula'],
+        configKey(task['config']),
+        task['seed'],
+        task['repeat'],
+    )
+
+
+make_experiment = """
+CREATE TABLE IF NOT EXISTS experiment
+    ( id              INTEGER PRIMARY KEY
+    , experiment_name TEXT
+    , seed            TEXT
+    , repetition      INTEGER
+    )
+"""
+
+save_experiment = """
+INSERT INTO experiment
+    ( experiment_name
+    , seed
+    , repetition
+    )
+VALUES
+    (?,?,?)
+"""
+
+make_algorithm_run = """
+CREATE TABLE IF NOT EXISTS algorithm_run
+    ( id            INTEGER PRIMARY KEY
+    , experiment_id INTEGER
+    , solver        TEXT
+    , formula_fname TEXT
+    , max_clause_len    INTEGER
+    , variables     INTEGER
+    , clauses       INTEGER
+    , cb            REAL
+    , time          INTEGER
+    , sat           BOOL
+    , FOREIGN KEY(experiment_id) REFERENCES experiment(id)
+    )
+"""
+
+save_algorithm_run = """
+INSERT INTO algorithm_run
+    ( id
+    , experiment_id
+    , solver
+    , formula_fname
+    , max_clause_len
+    , variables
+    , clauses
+    , cb
+    , time
+    , sat
+    )
+VALUES
+    (?,?,?,?,?,?,?,?,?,?)
+"""
+
+make_search_run = """
+CREATE TABLE IF NOT EXISTS search_run
+    ( id               INTEGER PRIMARY KEY
+    , algorithm_run_id INTEGER
+    , flips            INTEGER
+    , minimal_unsat    INTEGER
+    , last_unsat       INTEGER
+    , h_1              REAL
+    , h_2              REAL
+    , min_h            REAL
+    , FOREIGN KEY(algorithm_run_id) REFERENCES algorithm_run(id)
+    )
+"""
+
+save_search_run = """
+INSERT INTO search_run
+    ( id
+    , algorithm_run_id
+    , flips
+    , minimal_unsat
+    , last_unsat
+    , h_1
+    , h_2
+    , min_h
+    )
+VALUES
+    (?,?,?,?,?,?,?,?)
+"""
+
+make_dist_1 = """
+CREATE TABLE IF NOT EXISTS dist_1
+    ( id        INTEGER PRIMARY KEY
+    , run_id    INTEGER
+    , label     TEXT
+    , variable  INTEGER
+    , measure   REAL
+    , FOREIGN KEY(run_id) REFERENCES search_run(id)
+    )
+"""
+
+save_dist_1 = """
+INSERT INTO dist_1
+    ( run_id
+    , label
+    , variable
+    , measure
+    )
+VALUES
+    (?, ?, ?, ?)
+"""
+
+make_dist_2 = """
+CREATE TABLE IF NOT EXISTS dist_2
+    ( id         INTEGER PRIMARY KEY
+    , run_id     INTEGER
+    , label      TEXT
+    , variable_1 INTEGER
+    , variable_2 INTEGER
+    , measure    REAL
+    , FOREIGN KEY(run_id) REFERENCES search_run(id)
+    )
+"""
+
+save_dist_2 = """
+INSERT INTO dist_2
+    ( run_id
+    , label
+    , variable_1
+    , variable_2
+    , measure
+    )
+VALUES
+    (?,?,?,?,?)
+"""
+
+make_window_entropy = """
+CREATE TABLE IF NOT EXISTS window_entropy
+    ( id       INTEGER PRIMARY KEY
+    , run_id   INTEGER
+    , window   INTEGER
+    , min_h    REAL
+    , flip     INTEGER
+    , FOREIGN KEY(run_id) REFERENCES search_run(id)
+    )
+"""
+
+save_window_entropy = """
+INSERT INTO window_entropy
+    ( run_id
+    , window
+    , min_h
+    , flip
+    )
+VALUES
+    (?,?,?,?)
+"""
+
+make_flip_trace = """
+CREATE TABLE IF NOT EXISTS flip_trace
+    ( id       INTEGER PRIMARY KEY
+    , run_id   INTEGER
+    , path     TEXT
+    , FOREIGN KEY(run_id) REFERENCES search_run(id)
+    )
+"""
+
+save_flip_trace = """
+INSERT INTO flip_trace
+    ( run_id
+    , path
+    )
+VALUES
+    (?,?)
+"""
+
+make_task = """
+CREATE TABLE IF NOT EXISTS task
+    ( id               INTEGER PRIMARY KEY
+    , algorithm_run_id INTEGER
+    , experiment_name  TEXT
+    , formula_fname    TEXT
+    , config           TEXT
+    , seed             INTEGER
+    , repetition       INTEGER
+    , FOREIGN KEY(algorithm_run_id) REFERENCES algorithm_run(id)
+    )
+"""
+
+save_task = """
+INSERT INTO task
+    ( algorithm_run_id
+    , experiment_name
+    , formula_fname
+    , config
+    , seed
+    , repetition
+    )
+VALUES
+    (?,?,?,?,?,?)
+"""
+
+tables = [
+    ('experiment',     make_experiment,     save_experiment),
+    ('algorithm_run',  make_algorithm_run,  save_algorithm_run),
+    ('search_run',     make_search_run,     save_search_run),
+    ('dist_1',         make_dist_1,         save_dist_1),
+    ('dist_2',         make_dist_2,         save_dist_2),
+    ('window_entropy', make_window_entropy, save_window_entropy),
+    ('flip_trace',     make_flip_trace,     save_flip_trace),
+    ('task',           make_task,           save_task),
+]
+
+# The columns of the buffered rows which hold IDs of algorithm_run or
+# search_run rows, per table, as (index, table) pairs; see
+# ResultStore.flush.
+idColumns = {
+    'algorithm_run':  [(0, 'algorithm_run')],
+    'search_run':     [(0, 'search_run'), (1, 'algorithm_run')],
+    'dist_1':         [(0, 'search_run')],
+    'dist_2':         [(0, 'search_run')],
+    'window_entropy': [(0, 'search_run')],
+    'flip_trace':     [(0, 'search_run')],
+    'task':           [(0, 'algorithm_run')],
+}
+
+pragmas = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+]
+
+
+def createTables(conn):
+    """ Create the missing tables in the database of conn, and add the seed
+    and repetition columns to the experiment table of databases of older
+    runs; their rows keep NULL.
+    """
+    for _, make, _ in tables:
+        conn.execute(make)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(experiment)')]
+    for column, columnType in (('seed', 'TEXT'), ('repetition', 'INTEGER')):
+        if column not in columns:
+            conn.execute('ALTER TABLE experiment ADD COLUMN {} {}'
+                         .format(column, columnType))
+    conn.commit()
+
+
+def experimentId(conn, name, seed, repeat):
+    """ The ID of the experiment row of name, seed and repeat in the
+    database of conn. An existing row is reused, unless repeat is None, so
+    a repeat keeps one experiment ID across resumes and merges; otherwise a
+    row is inserted. Runs with other seeds draw other samples, and get rows
+    of their own.
+    """
+    seed = None if seed == None else str(seed)
+    rowId = None
+    if repeat != None:
+        rowId, = conn.execute(
+            """
+            SELECT MIN(id) FROM main.experiment
+            WHERE experiment_name = ? AND seed IS ? AND repetition = ?
+            """,
+            (name, seed, repeat)
+        ).fetchone()
+    if rowId == None:
+        rowId = conn.execute(save_experiment, (name, seed, repeat)).lastrowid
+    return rowId
+
+
+class ResultStore:
+    """ Writes results to the database at path. Rows are buffered, and
+    written in one transaction as soon as batchSize rows are pending, or
+    flushInterval seconds passed since the last write. Without wal, the
+    database keeps the default rollback journal, and is a single file
+    whenever no transaction is running.
+    """
+
+    def __init__(self, path, batchSize=50000, flushInterval=10,
+                 timeout=5*60, wal=True):
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        for pragma in pragmas:
+            if wal or 'journal_mode' not in pragma:
+                self.conn.execute(pragma)
+        createTables(self.conn)
+
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.rows = {name: [] for name, _, _ in tables}
+        self.pending = 0
+        self.lastFlush = time.time()
+        self.experimentName = None
+        self.seed = None
+        self.repeat = None
+        # The IDs of the written experiment rows, by (name, seed, repeat),
+        # see experimentIds.
+        self.experiments = {}
+
+        # The next free IDs of the tables, whose children are buffered
+        # along with them, and the first ID of the buffered rows. Buffered
+        # IDs are provisional, until flush reserves them.
+        self.nextId = {}
+        for name in ('algorithm_run', 'search_run'):
+            maxId, = self.conn.execute(
+                'SELECT MAX(id) FROM {}'.format(name)
+            ).fetchone()
+            self.nextId[name] = (maxId or 0) + 1
+        self.firstId = dict(self.nextId)
+
+
+    def newId(self, table):
+        rowId = self.nextId[table]
+        self.nextId[table] += 1
+        return rowId
+
+
+    def addExperiment(self, name, repeat=None, seed=None):
+        """ Start the experiment name, run with seed; subsequent results
+        belong to its repeat, or, if they have a task, to the repeat of
+        their task. No row is written before the first result of a repeat,
+        see experimentIds.
+        """
+        self.experimentName = name
+        self.seed = seed
+        self.repeat = repeat
+
+
+    def experimentIds(self, keys):
+        """ The IDs of the experiment rows of keys (name, seed, repeat),
+        under the write lock of flush, see experimentId.
+        """
+        ids = {}
+        for key in keys:
+            if key in self.experiments:
+                ids[key] = self.experiments[key]
+            else:
+                ids[key] = experimentId(self.conn, *key)
+        return ids
+
+
+    def addResult(self, result):
+        """ Buffer the rows of a result of the current experiment, or of
+        the experiment of its task's repeat, where the runs are summarized
+        as by summarizeRun and packed by packRuns.
+        """
+        if self.experimentName == None:
+            raise RuntimeError('First add an experiment.')
+
+        repeat = self.repeat
+        if 'task' in result:
+            repeat = result['task']['repeat']
+
+        rows = self.rows
+        algId = self.newId('algorithm_run')
+        # The experiment ID is looked up by flush.
+        rows['algorithm_run'].append((
+            algId,
+            (self.experimentName, self.seed, repeat),
+            "probSAT",
+            result['formula_fname'],
+            result['max_clause_len'],
+            result['variables'],
+            result['clauses'],
+            result['cb'],
+            result['time'],
+            result['sat'],
+        ))
+        count = 1
+        # The runs are packed by packRuns; entries of variable 0 are missing.
+        runs = result['runs']
+        runIds = []
+        for run in zip(*(runs[name].tolist() for name in runs.dtype.names)):
+            (flips, minimal_unsat, last_unsat, h_1, h_2, min_h,
+             var_1, measure_1, var_2, measure_2) = run
+            runId = self.newId('search_run')
+            runIds.append(runId)
+            rows['search_run'].append((
+                runId,
+                algId,
+                flips,
+                minimal_unsat,
+                last_unsat,
+                h_1,
+                h_2,
+                min_h,
+            ))
+            for lbl, var, measure in zip(measureLabels, var_1, measure_1):
+                if var != 0:
+                    rows['dist_1'].append((runId, lbl, var, measure))
+                    count += 1
+            for lbl, (v1, v2), measure in zip(measureLabels, var_2, measure_2):
+                if v1 != 0:
+                    rows['dist_2'].append((runId, lbl, v1, v2, measure))
+                    count += 1
+            count += 1
+        for idx, window, min_h, flip in result['windows']:
+            rows['window_entropy'].append((runIds[idx], window, min_h, flip))
+        for idx, path in result['traces']:
+            rows['flip_trace'].append((runIds[idx], path))
+        count += len(result['windows']) + len(result['traces'])
+        # The task row is written in the same transaction as the rows of
+        # its result, and marks it finished, see finishedTasks.
+        if 'task' in result:
+            formula, config, seed, repeat = taskKey(result['task'])
+            rows['task'].append((
+                algId,
+                self.experimentName,
+                formula,
+                config,
+                seed,
+                repeat,
+            ))
+            count += 1
+
+        self.pending += count
+        if self.pending >= self.batchSize \
+                or time.time() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+
+    def shiftIds(self, name, rows, offsets):
+        """ The buffered rows of the table name, with their provisional IDs,
+        and references to them, shifted by the offsets of their tables.
+        """
+        columns = [(idx, table) for idx, table in idColumns.get(name, [])
+                   if offsets[table] != 0]
+        if not columns:
+            return rows
+        shifted = []
+        for row in rows:
+            row = list(row)
+            for idx, table in columns:
+                if row[idx] >= self.firstId[table]:
+                    row[idx] += offsets[table]
+            shifted.append(row)
+        return shifted
+
+
+    def flush(self):
+        """ Write all buffered rows in one transaction. The buffers are only
+        emptied once it is committed; if it fails, and is rolled back, the
+        rows are still buffered for the next flush.
+
+        The IDs are reserved under the write lock, taken by BEGIN
+        IMMEDIATE: if other stores wrote to the database since the last
+        flush, the buffered IDs are shifted past their rows. The experiment
+        rows of the buffered results are looked up, or created, alike.
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        with self.conn:
+            experiments = self.experimentIds(
+                set(row[1] for row in self.rows['algorithm_run'])
+            )
+            rows = dict(self.rows)
+            rows['algorithm_run'] = [
+                (row[0], experiments[row[1]]) + row[2:]
+                for row in self.rows['algorithm_run']
+            ]
+            offsets = {}
+            for table in self.nextId:
+                maxId, = self.conn.execute(
+                    'SELECT MAX(id) FROM {}'.format(table)
+                ).fetchone()
+                offsets[table] = max(0, (maxId or 0) + 1 - self.firstId[table])
+            for name, _, save in tables:
+                if rows[name]:
+                    self.conn.executemany(
+                        save,
+                        self.shiftIds(name, rows[name], offsets)
+                    )
+        self.rows = {name: [] for name, _, _ in tables}
+        self.experiments.update(experiments)
+        for table, offset in offsets.items():
+            self.nextId[table] += offset
+            self.firstId[table] = self.nextId[table]
+        self.pending = 0
+        self.lastFlush = time.time()
+
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def finishedTasks(path, name):
+    """ The keys (see taskKey) of the finished tasks of the experiment name
+    in the database at path.
+    """
+    if not os.path.exists(path):
+        return set()
+    with sqlite3.connect(path, timeout=5*60) as conn:
+        present, = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master"
+            " WHERE type = 'table' AND name = 'task'"
+        ).fetchone()
+        if not present:
+            return set()
+        # The configs of older runs may still hold runOptions.
+        return set(
+            (formula, configKey(json.loads(config)), seed, repeat)
+            for formula, config, seed, repeat in conn.execute(
+                """
+                SELECT formula_fname, config, seed, repetition FROM task
+                WHERE experiment_name = ?
+                """,
+                (name,)
+            )
+        )
+
+
+def runTimes(path):
+    """ The mean time of the algorithm runs per formula and cb in the
+    database at path, as a dict keyed on (formula_fname, cb).
+    """
+    if not os.path.exists(path):
+        return {}
+    with sqlite3.connect(path, timeout=5*60) as conn:
+        present, = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master"
+            " WHERE type = 'table' AND name = 'algorithm_run'"
+        ).fetchone()
+        if not present:
+            return {}
+        return {
+            (formula, cb): time
+            for formula, cb, time in conn.execute(
+                """
+                SELECT formula_fname, cb, AVG(time) FROM algorithm_run
+                GROUP BY formula_fname, cb
+                """
+            )
+        }
+
+
+def runStore(path, queue, kwargs):
+    """ Feed the items of queue to a ResultStore at path, until None. """
+    store = ResultStore(path, **kwargs)
+    try:
+        for kind, item in iter(queue.get, None):
+            if kind == 'experiment':
+                store.addExperiment(*item)
+            else:
+                store.addResult(item)
+    finally:
+        store.close()
+
+
+class StoreWriter:
+    """ A ResultStore in a separate process, with the same interface; the
+    caller only puts the results into a queue, and never waits on SQLite,
+    unless maxPending results are waiting to be written.
+    """
+
+    def __init__(self, path, maxPending=1000, **kwargs):
+        self.queue = Queue(maxsize=maxPending)
+        self.process = Process(target=runStore,
+                               args=(path, self.queue, kwargs))
+        self.process.start()
+
+
+    def addExperiment(self, name, repeat=None, seed=None):
+        self.queue.put(('experiment', (name, repeat, seed)))
+
+
+    def addResult(self, result):
+        self.queue.put(('result', result))
+
+
+    def close(self):
+        self.queue.put(None)
+        self.process.join()
+        if self.process.exitcode != 0:
+            raise RuntimeError('The store writer failed with exit code {}.'
+                               .format(self.process.exitcode))
+
+
+# Columns copied by mergeStore, per table, after the id; (column, parent)
+# pairs refer to the ID of a parent table, and are shifted with it, or, for
+# experiment, mapped to the merged experiment row.
+mergeColumns = [
+    ('algorithm_run',  True,  [('experiment_id', 'experiment'), 'solver',
+                               'formula_fname', 'max_clause_len',
+                               'variables', 'clauses', 'cb', 'time',
+                               'sat']),
+    ('search_run',     True,  [('algorithm_run_id', 'algorithm_run'),
+                               'flips', 'minimal_unsat', 'last_unsat',
+                               'h_1', 'h_2', 'min_h']),
+    ('dist_1',         False, [('run_id', 'search_run'), 'label',
+                               'variable', 'measure']),
+    ('dist_2',         False, [('run_id', 'search_run'), 'label',
+                               'variable_1', 'variable_2', 'measure']),
+    ('window_entropy', False, [('run_id', 'search_run'), 'window',
+                               'min_h', 'flip']),
+    ('flip_trace',     False, [('run_id', 'search_run'), 'path']),
+    ('task',           False, [('algorithm_run_id', 'algorithm_run'),
+                               'experiment_name', 'formula_fname', 'config',
+                               'seed', 'repetition']),
+]
+
+
+def mergeExperiments(conn, sourceColumns):
+    """ Map every experiment row of the attached database source to the
+    row of the same name, seed and repetition in the database of conn, see
+    experimentId, in the table temp.experiment_map. So the shards of one
+    run share their rows, while runs with other seeds keep their own.
+    """
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS experiment_map
+            ( source INTEGER PRIMARY KEY
+            , target INTEGER
+            )
+    """)
+    conn.execute('DELETE FROM temp.experiment_map')
+    rows = conn.execute(
+        'SELECT id, experiment_name, {}, {} FROM source.experiment'.format(
+            *(column if column in sourceColumns else 'NULL'
+              for column in ('seed', 'repetition'))
+        )
+    ).fetchall()
+    for sourceId, name, seed, repeat in rows:
+        conn.execute(
+            'INSERT INTO temp.experiment_map VALUES (?,?)',
+            (sourceId, experimentId(conn, name, seed, repeat))
+        )
+
+
+def mergeStore(conn, source):
+    """ Copy all rows of the database source into the database of conn,
+    with INSERT ... SELECT, in one transaction. Experiment rows are merged
+    by name, seed and repetition, so the shards of a run share one
+    experiment row per repeat. The IDs of algorithm_run and search_run rows are shifted
+    past the IDs already in conn, and references to them are shifted alike.
+    Tables missing in source, like in databases of older runs, are skipped,
+    and missing columns are NULL.
+    """
+    conn.execute('ATTACH DATABASE ? AS source', (source,))
+    try:
+        present = {name for name, in conn.execute(
+            "SELECT name FROM source.sqlite_master WHERE type = 'table'"
+        )}
+        with conn:
+            if 'experiment' in present:
+                mergeExperiments(conn, {row[1] for row in conn.execute(
+                    'PRAGMA source.table_info(experiment)'
+                )})
+            offsets = {}
+            for table, keepId, columns in mergeColumns:
+                if keepId:
+                    maxId, = conn.execute(
+                        'SELECT MAX(id) FROM main.{}'.format(table)
+                    ).fetchone()
+                    offsets[table] = maxId or 0
+            for table, keepId, columns in mergeColumns:
+                if table not in present:
+                    continue
+                sourceColumns = {row[1] for row in conn.execute(
+                    'PRAGMA source.table_info({})'.format(table)
+                )}
+                names = []
+                values = []
+                if keepId:
+                    names.append('id')
+                    values.append('id + {}'.format(offsets[table]))
+                for column in columns:
+                    if type(column) == tuple:
+                        column, parent = column
+                        if parent == 'experiment':
+                            values.append(
+                                '(SELECT target FROM temp.experiment_map'
+                                ' WHERE source = {})'.format(column)
+                            )
+                        else:
+                            values.append('{} + {}'.format(column,
+                                                           offsets[parent]))
+                    elif column in sourceColumns:
+                        values.append(column)
+                    else:
+                        values.append('NULL')
+                    names.append(column)
+                conn.execute(
+                    'INSERT INTO main.{0} ({1}) SELECT {2} FROM source.{0}'
+                    .format(table, ', '.join(names), ', '.join(values))
+                )
+    finally:
+        conn.execute('DETACH DATABASE source')
+
+
+def mergeStores(target, sources):
+    """ Merge the databases sources, like per-worker shards or the
+    databases of separate jobs, into the database target.
+    """
+    conn = sqlite3.connect(target, timeout=5*60)
+    try:
+        for pragma in pragmas:
+            conn.execute(pragma)
+        createTables(conn)
+        for source in sources:
+            mergeStore(conn, source)
+    finally:
+        conn.close()
@@ -0,0 +1,102 @@
+""" Flip traces: the sequence of flipped variables of a run, and optionally
+the number of unsatisfied clauses before each flip, written to a binary file
+while the walk runs, and memory mapped for offline analysis.
+
+Layout: a fixed header (see 'header'), followed by int32 rows of 'columns'
+entries each, one row per flip.
+"""
+
+import os
+import tempfile
+import numpy as np
+from array import array
+
+MAGIC = b'FTRC'
+VERSION = 1
+EXTENSION = '.trace'
+
+header = np.dtype([
+    ('magic',             'S4'),
+    ('version',           '<u4'),
+    ('columns',           '<u4'),
+    ('numVars',           '<u4'),
+    ('numClauses',        '<i8'),
+])
+
+
+class TraceWriter:
+    """ Appends flips to an int32 buffer of chunkSize rows, which is written
+    to the trace file whenever it is full, and on close.
+    """
+
+    def __init__(self, path, numVars, numClauses,
+                 withUnsat=False, chunkSize=1<<16):
+        self.path = path
+        self.columns = 2 if withUnsat else 1
+        self.limit = chunkSize * self.columns
+        self.buffer = array('i')
+        self.file = open(path, 'wb')
+
+        head = np.zeros(1, dtype=header)
+        head['magic'] = MAGIC
+        head['version'] = VERSION
+        head['columns'] = self.columns
+        head['numVars'] = numVars
+        head['numClauses'] = numClauses
+        self.file.write(head.tobytes())
+
+        # add(var, unsat) records one flip.
+        self.add = self.addFlipUnsat if withUnsat else self.addFlip
+
+
+    def addFlip(self, var, unsat):
+        self.buffer.append(var)
+        if len(self.buffer) >= self.limit:
+            self.flush()
+
+
+    def addFlipUnsat(self, var, unsat):
+        self.buffer.append(var)
+        self.buffer.append(unsat)
+        if len(self.buffer) >= self.limit:
+            self.flush()
+
+
+    def flush(self):
+        self.buffer.tofile(self.file)
+        del self.buffer[:]
+
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def openTrace(directory, name, numVars, numClauses, **kwargs):
+    """ A TraceWriter on a new file in directory, whose name starts with
+    name; concurrent runs on the same formula get distinct files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory,
+                                prefix=name + '-',
+                                suffix=EXTENSION)
+    os.close(fd)
+    return TraceWriter(path, numVars, numClauses, **kwargs)
+
+
+def readTrace(path):
+    """ Memory map the trace at path, and return the header and a read-only
+    int32 array of shape (flips, columns); column 0 holds the flipped
+    variables, column 1, if present, the unsat count before each flip.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    head = data[:header.itemsize].view(header)[0]
+    if head['magic'] != MAGIC or head['version'] != VERSION:
+        raise ValueError('{} is no flip trace of version {}.'
+                         .format(path, VERSION))
+
+    columns = int(head['columns'])
+    rowBytes = 4*columns
+    flips = (len(data) - header.itemsize) // rowBytes
+    end = header.itemsize + flips*rowBytes
+    return head, data[header.itemsize:end].view('<i4').reshape(flips, columns)
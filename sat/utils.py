@@ -1,6 +1,122 @@
 import random
 import re
 import math
+import numpy as np
+
+def pairKeyType(width):
+    """ The smallest int type for the pair keys var_1*width + var_2. """
+    return np.int32 if width*width <= np.iinfo(np.int32).max else np.int64
+
+
+def decodePairKeys(keys, numVars):
+    """ Split pair keys var_1*(numVars+1) + var_2 into var_1 and var_2. """
+    return keys // (numVars+1), keys % (numVars+1)
+
+
+def evalDist(keys, counts):
+    """ The entropy of the distribution given by counts, and its entries of
+    maximal and minimal entropy and probability, as (key, value); entries
+    with count 0 are left out.
+    """
+    nonzero = counts > 0
+    keys = keys[nonzero]
+    counts = counts[nonzero]
+    if len(counts) == 0:
+        return 0.0, {}
+    probs = counts / counts.sum()
+    entropies = -probs * np.log2(probs)
+
+    def at(values, idx):
+        return (int(keys[idx]), float(values[idx]))
+
+    return (
+        float(entropies.sum()),
+        {
+            'max_h': at(entropies, entropies.argmax()),
+            'min_h': at(entropies, entropies.argmin()),
+            'max_p': at(probs, probs.argmax()),
+            'min_p': at(probs, probs.argmin())
+        }
+    )
+
+
+def summarizeRun(record, numVars):
+    """ Replace the flip counts dist_1 and dist_2 of a run record by their
+    entropies h_1 and h_2, and their extremal entries ms_1 and ms_2, keyed
+    by variable and by pair of variables respectively.
+    """
+    dist_1 = record.pop('dist_1')
+    keys, counts = record.pop('dist_2')
+    record['h_1'], record['ms_1'] = evalDist(np.arange(len(dist_1)), dist_1)
+    record['h_2'], ms_2 = evalDist(keys, counts)
+    record['ms_2'] = {
+        lbl: (tuple(map(int, decodePairKeys(key, numVars))), measure)
+        for lbl, (key, measure) in ms_2.items()
+    }
+    return record
+
+
+# The labels of the extremal entries of summarizeRun, in field order.
+measureLabels = ('max_h', 'min_h', 'max_p', 'min_p')
+
+# One row per summarized run, see packRuns: its scalars, and for each label
+# the variable (pair) and value of the extremal entry of dist_1 and dist_2.
+# Missing entries, of runs without flips, have variable 0.
+runDtype = np.dtype(
+    [
+        ('flips',         np.int64),
+        ('minimal_unsat', np.int64),
+        ('last_unsat',    np.int64),
+        ('h_1',           np.float64),
+        ('h_2',           np.float64),
+        ('min_h',         np.float64),
+        ('var_1',         np.int32,   (len(measureLabels),)),
+        ('measure_1',     np.float64, (len(measureLabels),)),
+        ('var_2',         np.int32,   (len(measureLabels), 2)),
+        ('measure_2',     np.float64, (len(measureLabels),)),
+    ]
+)
+
+
+def packRuns(runs):
+    """ Pack the summarized run records into one array of runDtype; window
+    minima and trace paths, which only some runs have, are returned as
+    lists of (run index, ...) rows.
+    """
+    rows = []
+    windows = []
+    traces = []
+    missing = (0, float('nan'))
+    missingPair = ((0, 0), float('nan'))
+    for idx, run in enumerate(runs):
+        ms_1 = [run['ms_1'].get(lbl, missing) for lbl in measureLabels]
+        ms_2 = [run['ms_2'].get(lbl, missingPair) for lbl in measureLabels]
+        rows.append((
+            run['flips'],
+            run['minimal_unsat'],
+            run['last_unsat'],
+            run['h_1'],
+            run['h_2'],
+            run['min_h'],
+            [var for var, _ in ms_1],
+            [measure for _, measure in ms_1],
+            [pair for pair, _ in ms_2],
+            [measure for _, measure in ms_2],
+        ))
+        for window, min_h, flip in run.get('min_h_windows', []):
+            windows.append((idx, window, min_h, flip))
+        if 'trace' in run:
+            traces.append((idx, run['trace']))
+    return np.array(rows, dtype=runDtype), windows, traces
+
+
+def unpackRuns(runs):
+    """ The rows of an array of runDtype as dicts of plain values. """
+    # tolist leaves the subarray fields of records as arrays, columns not.
+    columns = [runs[name].tolist() for name in runs.dtype.names]
+    return [dict(zip(runs.dtype.names, row)) for row in zip(*columns)]
+
+
 
 class Queue:
     """ Models a queue with no need for explicit deletion. """
@@ -37,6 +153,32 @@ class Queue:
 
 
 
+class RandomStream:
+    """ A stream of random numbers, drawn in blocks from a numpy Generator,
+    so that taking the next one is a single call without the overhead of
+    the random module.
+    """
+    def __init__(self, seed = None, blockSize = 4096):
+        if not type(blockSize) == int or blockSize <= 0:
+            raise ValueError('blockSize = {} is no positive int.'
+                             .format(blockSize))
+        self.generator = np.random.default_rng(seed)
+        self.blockSize = blockSize
+        # random() returns the next uniform float in [0,1).
+        self.random = self.floats().__next__
+
+
+    def floats(self):
+        while True:
+            yield from self.generator.random(self.blockSize).tolist()
+
+
+    def bools(self, count):
+        """ Returns a list of count uniformly random bools. """
+        return self.generator.integers(0, 2, count, dtype=bool).tolist()
+
+
+
 class Falselist:
     """ Models a list with no need for order. """
     def __init__(self):
@@ -69,6 +211,16 @@ class Falselist:
         self.mapping[elem] = len(self.lst)-1
 
 
+    def discard(self, elem):
+        """ Removes elem, rather than the element at a position. """
+        self.remove(self.mapping[elem])
+
+
+    def clear(self):
+        self.lst = []
+        self.mapping = {}
+
+
     def __len__(self):
         return self.length()
 
@@ -77,9 +229,79 @@ class Falselist:
 
 
 
+class ArrayFalselist(Falselist):
+    """ Models a list with no need for order, of clause indices below a
+    fixed size: lst is preallocated, and only its first 'count' entries are
+    valid; position[c] is the position of clause c in lst. Adding,
+    discarding and picking are O(1) without any dict.
+    """
+    def __init__(self, size):
+        if not type(size) == int:
+            raise TypeError('Type of size :: {} is not int'
+                            .format(type(size)))
+        self.lst = [0]*size
+        self.position = [0]*size
+        self.count = 0
+
+
+    def remove(self, idx):
+        if not type(idx) == int:
+            raise TypeError('Type of idx :: {} is not int'
+                            .format(type(idx)))
+        if idx < 0:
+            raise IndexError('idx = {} is negative'
+                             .format(idx))
+        if idx >= self.count:
+            raise IndexError('idx = {} is greater or equal to count = {}'
+                             .format(idx, self.count))
+
+        self.discard(self.lst[idx])
+
+
+    def add(self, elem):
+        self.position[elem] = self.count
+        self.lst[self.count] = elem
+        self.count += 1
+
+
+    def discard(self, elem):
+        # Move the last element into the gap.
+        pos = self.position[elem]
+        self.count -= 1
+        last = self.lst[self.count]
+        self.lst[pos] = last
+        self.position[last] = pos
+
+
+    def clear(self):
+        self.count = 0
+
+
+    def pick(self, r):
+        """ Returns the element at r*count for r in [0,1), that is, a
+        uniformly chosen one for uniform r.
+        """
+        return self.lst[int(r * self.count)]
+
+
+    def length(self):
+        return self.count
+
+
+
 class Entropytracker:
-    def __init__(self, size, symbols):
-        self.queue = Queue(size)
+    """ Tracks the entropy of the last 'size' elements added, over the
+    symbols 1..symbols.
+
+    The window is a preallocated ring buffer, and count holds the number of
+    occurrences of each symbol in it. With trackMax, the symbols are also
+    kept in buckets by their count, so that max_entropy_variable is O(1)
+    (amortized) instead of a scan over all symbols.
+    """
+    def __init__(self, size, symbols, trackMax = False):
+        self.ring = [0]*size
+        self.pos = 0
+        self.filled = 0
         self.count = [0]*(symbols+1)
         self.entropy = 0
         self.size = size
@@ -91,83 +313,126 @@ class Entropytracker:
             p = x/self.size
             self.h[x] = p*math.log(p,2)
 
+        self.trackMax = trackMax
+        if trackMax:
+            # buckets[c] holds the symbols occurring c times; peak is the
+            # count with the largest entropy contribution; lo is the
+            # largest nonempty bucket up to peak (or 0), and hi the
+            # smallest one above it (or size+1).
+            self.buckets = [set() for _ in range(0, self.size+1)]
+            self.peak = max(range(1, self.size+1),
+                            key = lambda c: abs(self.h[c]),
+                            default = 0)
+            self.lo = 0
+            self.hi = self.size+1
+
 
     def calculateEntropy(self):
+        """ The entropy of the current window, computed from the counts of
+        the symbols in it only.
+        """
+        length = len(self)
         entropy = 0
-        for c in self.count:
-            if c > 0:
-                p = c/len(self.queue)
-                entropy -= p*math.log(p,2)
+        for elem in set(self.ring[:length]):
+            p = self.count[elem]/length
+            entropy -= p*math.log(p,2)
         return entropy
 
     def max_entropy_variable(self):
-        (l,c) = max(
-            list(enumerate(self.count))[1:],
-            key = lambda args: abs(self.h[args[1]])
-        )
-        return l, abs(self.h[c]), c/self.size
+        if not self.trackMax:
+            (l,c) = max(
+                list(enumerate(self.count))[1:],
+                key = lambda args: abs(self.h[args[1]])
+            )
+            return l, abs(self.h[c]), c/self.size
+
+        c = self.lo
+        if self.hi <= self.size and (
+                c == 0 or abs(self.h[self.hi]) > abs(self.h[c])):
+            c = self.hi
+        if c == 0:
+            return 1, 0, 0
+        return next(iter(self.buckets[c])), abs(self.h[c]), c/self.size
+
+    def moveBucket(self, elem, old, new):
+        """ Move elem from the bucket of count old to the one of count new,
+        which differ by one, and update lo and hi.
+        """
+        if new > 0:
+            bucket = self.buckets[new]
+            bucket.add(elem)
+            if len(bucket) == 1:
+                if new <= self.peak:
+                    if new > self.lo:
+                        self.lo = new
+                elif new < self.hi:
+                    self.hi = new
+        if old > 0:
+            bucket = self.buckets[old]
+            bucket.discard(elem)
+            if not bucket:
+                # Only searches, if elem crossed the peak.
+                if old == self.lo:
+                    self.lo = old-1
+                    while self.lo > 0 and not self.buckets[self.lo]:
+                        self.lo -= 1
+                elif old == self.hi:
+                    self.hi = old+1
+                    while self.hi <= self.size and not self.buckets[self.hi]:
+                        self.hi += 1
 
     def add(self, elem):
-        """ Adds a new element to the queue, and updates the entropy,
-        if the queue is of limited size.
+        """ Adds a new element to the window, and updates the entropy.
+        Returns whether an element was dropped from the window for it.
         """
-
-        # If the queue is filled, it drops a value, if a new one is added;
-        # this value is then to be deleted from the tracker.
-        ret = self.queue.write(elem)
-        # If the queue dropped an element
-        if ret:
-            # calculate the OLD probability of this dropped element
-            pOld = self.count[ret]
-            # calculate the NEW probability of this dropped element
-            # (may be 0).
-            pNew = pOld-1
-            # If the NEW probability is 0
-            if pNew == 0:
-                # Just subtract the respective entropy
-                self.entropy += self.h[pOld]
+        count = self.count
+        h = self.h
+
+        # If the window is filled, it drops its oldest element, if a new
+        # one is added; this element is then to be deleted from the
+        # tracker.
+        dropped = self.filled >= self.size
+        if dropped:
+            ret = self.ring[self.pos]
+            # Subtract the entropy of the OLD count of the dropped element
+            # and add the entropy of the NEW one (h[0] is 0).
+            c = count[ret]
+            self.entropy += h[c] - h[c-1]
+            if c == 1:
                 self.untracked += 1
-            # Otherwise
-            else:
-                # Subtrackt the entropy of the OLD probability
-                # and add the entropy of the NEW one.
-                self.entropy += self.h[pOld] - self.h[pNew]
-            # Decrement the counter then.
-            self.count[ret] -= 1
-        # Calculate the OLD probability of the newly added element
-        # (may be 0).
-        pOld = self.count[elem]
-        # Calculate the NEW probability of the newly added element
-        # (is at least 1/#elements)
-        pNew = pOld+1
-        # If the OLD probability is 0, id est, the element was
-        # not counted before.
-        if pOld == 0:
-            # Just add the entropy of the NEW probability
-            # (== H(1/#elements)).
-            self.entropy -= self.h[pNew]
-            self.untracked -= 1
-        # Otherwise
+            count[ret] = c-1
+            if self.trackMax:
+                self.moveBucket(ret, c, c-1)
         else:
-            # Subtract the entropy of the OLD probability,
-            # and add the entropy of the NEW one.
-            #print("{} {} {}".format(len(self.h), pOld, pNew))
-            self.entropy += self.h[pOld] - self.h[pNew]
-        # Increment the counter then.
-        self.count[elem] += 1
+            self.filled += 1
 
-        return (ret != None)
+        self.ring[self.pos] = elem
+        self.pos += 1
+        if self.pos == self.size:
+            self.pos = 0
+
+        # Subtract the entropy of the OLD count of the newly added element,
+        # and add the entropy of the NEW one.
+        c = count[elem]
+        self.entropy += h[c] - h[c+1]
+        if c == 0:
+            self.untracked -= 1
+        count[elem] = c+1
+        if self.trackMax:
+            self.moveBucket(elem, c, c+1)
+
+        return dropped
 
 
     def getEntropy(self, relative=False, force = False):
-        """ If the queue is sufficiently filled, return the entropy,
+        """ If the window is sufficiently filled, return the entropy,
         otherwise return None.
         """
-        # Return the entropy only, if the queue is sufficiently filled,
+        # Return the entropy only, if the window is sufficiently filled,
         # for it would not be valid otherwise.
         tracked = self.symbols - self.untracked
-        tracked = tracked if tracked is not 1 else (tracked - 0.01)
-        if self.queue.isFilled():
+        tracked = tracked if tracked != 1 else (tracked - 0.01)
+        if self.filled >= self.size:
             return self.entropy / (math.log(tracked, 2) if relative else 1) # + math.log(self.untracked, 2) if self.untracked > 0 else 0
         elif force:
             return self.calculateEntropy() / (math.log(tracked, 2) if relative else 1)
@@ -176,7 +441,87 @@ class Entropytracker:
 
 
     def __len__(self):
-        return len(self.queue)
+        return self.filled
+
+
+
+class MultiEntropytracker:
+    """ Tracks the entropy of the last elements added for several window
+    sizes at once, with one shared history of the largest window.
+
+    minima holds [size, minimal entropy, number of elements added when it
+    was reached] per window; like Entropytracker, a window only counts once
+    it is filled and drops elements. The minimal entropy starts at
+    log2(symbols), with no position.
+    """
+    def __init__(self, sizes, symbols):
+        if not sizes or min(sizes) <= 0:
+            raise ValueError('sizes = {} must be positive.'.format(sizes))
+
+        self.sizes = list(sizes)
+        self.length = max(self.sizes)
+        self.history = [0]*self.length
+        self.pos = 0
+        self.added = 0
+        self.symbols = symbols
+        self.counts = [[0]*(symbols+1) for _ in self.sizes]
+        self.entropies = [0]*len(self.sizes)
+        self.h = []
+        for size in self.sizes:
+            h = [0]*(size+1)
+            for x in range(1, size+1):
+                p = x/size
+                h[x] = p*math.log(p,2)
+            self.h.append(h)
+        self.minima = [[size, math.log(symbols, 2), None]
+                       for size in self.sizes]
+
+
+    def add(self, elem):
+        """ Adds a new element to all windows, and updates their entropies
+        and minima.
+        """
+        history = self.history
+        self.added += 1
+        added = self.added
+        for i in range(0, len(self.sizes)):
+            size = self.sizes[i]
+            count = self.counts[i]
+            h = self.h[i]
+            entropy = self.entropies[i]
+            full = added > size
+            if full:
+                # The element leaving this window; the shared history is
+                # only overwritten after all windows are updated.
+                ret = history[(self.pos - size) % self.length]
+                c = count[ret]
+                entropy += h[c] - h[c-1]
+                count[ret] = c-1
+            c = count[elem]
+            entropy += h[c] - h[c+1]
+            count[elem] = c+1
+            self.entropies[i] = entropy
+            if full and entropy < self.minima[i][1]:
+                self.minima[i][1] = entropy
+                self.minima[i][2] = added
+
+        history[self.pos] = elem
+        self.pos += 1
+        if self.pos == self.length:
+            self.pos = 0
+
+
+    def getEntropy(self, i):
+        """ The entropy of the i-th window, if it is filled, otherwise
+        None.
+        """
+        if self.added < self.sizes[i]:
+            return None
+        return self.entropies[i]
+
+
+    def __len__(self):
+        return min(self.added, self.length)
 
 
 class CNF:
@@ -287,10 +632,227 @@ class CNF:
 
 
 
+class FlatLists:
+    """ Models a read-only list of int lists, stored CSR-style as one flat
+    buffer of values and an offset buffer, where the i-th list is
+    values[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+        # Indexing memoryviews yields plain ints, for array('i') as well as
+        # for int32 numpy arrays.
+        self._view = memoryview(values)
+        self._offsets = memoryview(offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self._view[self._offsets[idx]:self._offsets[idx+1]]
+
+    def __iter__(self):
+        view = self._view
+        offsets = self._offsets
+        for i in range(0, len(offsets)-1):
+            yield view[offsets[i]:offsets[i+1]]
+
+    def toMatrix(self, width, fill):
+        """ Return the lists as rows of a numpy matrix with the given width,
+        padded with fill.
+        """
+        offsets = np.asarray(self.offsets)
+        lengths = np.diff(offsets)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        cols = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+        matrix = np.full((len(lengths), width), fill, dtype=np.int32)
+        matrix[rows, cols] = np.asarray(self.values)[offsets[0]:offsets[-1]]
+        return matrix
+
+    def __getstate__(self):
+        # memoryviews cannot be pickled.
+        return (self.values, self.offsets)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+
+class CompactCNF(CNF):
+    """ Models CNF-Formulas in the DIMACS format, with all literals held in
+    one contiguous int32 buffer, and a CSR-style literal->clause occurrence
+    index, instead of one python list per clause and literal.
+
+    'clauses' and 'occurrences' are FlatLists, so clause and occurrence
+    access works as for CNF, but yields memoryview slices of ints.
+    """
+
+    def __init__(self, filepath = None):
+        self.literals = np.zeros(0, dtype=np.int32)
+        self.clauseOffsets = np.zeros(1, dtype=np.int32)
+        self.occurrenceIndex = np.zeros(0, dtype=np.int32)
+        self.occurrenceOffsets = np.zeros(1, dtype=np.int32)
+        self.numClauses = 0
+        self.numVars = 0
+        self.comments = []
+        self.initIndex()
+
+        if filepath == None:
+            self.isInit = False
+        else:
+            self.initFormulaFromFile(filepath)
+
+    def initIndex(self):
+        self.clauses = FlatLists(self.literals, self.clauseOffsets)
+        self.occurrences = FlatLists(self.occurrenceIndex,
+                                     self.occurrenceOffsets)
+        self._clauseMatrix = None
+
+    def clauseMatrix(self):
+        """ The clauses as numClauses x maxClauseLength matrix of literals,
+        padded with 0.
+        """
+        if self._clauseMatrix is None:
+            self._clauseMatrix = self.clauses.toMatrix(self.maxClauseLength, 0)
+        return self._clauseMatrix
+
+    def countUnsat(self, assignment):
+        """ The number of clauses falsified by a TruthAssignment, evaluated
+        for all clauses at once.
+        """
+        self.checkInit()
+
+        if not isinstance(assignment, TruthAssignment):
+            raise TypeError('The given argument is no truth assignment.')
+
+        truth = np.frombuffer(assignment.truth, dtype=np.uint8)
+        satisfied = truth[self.clauseMatrix()].any(axis=1)
+        return len(satisfied) - int(np.count_nonzero(satisfied))
+
+    def isSatisfiedBy(self, assignment):
+        if isinstance(assignment, TruthAssignment):
+            return self.countUnsat(assignment) == 0
+        return super().isSatisfiedBy(assignment)
+
+    def initFormulaFromFile(self, filepath):
+        """ Given the filepath of a CNF file in DIMACS format,
+        read it and initialize the object.
+
+        The whole file is tokenized at once, and clauses are split at
+        their terminating 0, so clauses may span several lines, and lines
+        may hold several clauses.
+        """
+        if not type(filepath) == str:
+            raise TypeError("Argument 'filepath' was no string.")
+
+        # Terminate, if the file has no .cnf extension.
+        if not filepath.endswith('.cnf'):
+            raise ValueError(filepath + " is no .cnf file.")
+
+        with open(filepath, 'rb') as f:
+            data = f.read()
+
+        # Collect comments and the header in one scan over the non clause
+        # lines, and keep the chunks of clauses in between.
+        chunks = []
+        begin = 0
+        for match in CompactCNF._nonClause.finditer(data):
+            chunks.append(data[begin:match.start()])
+            begin = match.end()
+            line = match.group()
+            if line[0] == ord('c'):
+                self.comments.append(line.rstrip(b'\r').decode() + '\n')
+            elif line[0] == ord('p'):
+                self.numVars = int(line.split()[2])
+            else:
+                # Everything after a line starting with '%' is no formula
+                # (SATLIB style trailer).
+                begin = len(data)
+                break
+        chunks.append(data[begin:])
+        if self.numVars <= 0:
+            raise ValueError(filepath + " has no valid 'p cnf' line.")
+
+        # Read all numbers in one pass.
+        tokens = np.fromstring(b' '.join(chunks), dtype=np.int32, sep=' ')
+
+        if len(tokens) > 0 and tokens[-1] != 0:
+            raise ValueError(filepath + " ends with a clause without 0.")
+        zeros = np.flatnonzero(tokens == 0)
+        literals = tokens[tokens != 0]
+        if len(literals) > 0 and np.abs(literals).max() > self.numVars:
+            raise ValueError(filepath + " has a literal beyond variable "
+                             + str(self.numVars) + ".")
+        # The i-th terminator sits behind i earlier terminators.
+        clauseOffsets = np.zeros(len(zeros)+1, dtype=np.int32)
+        clauseOffsets[1:] = zeros - np.arange(len(zeros))
+
+        self.initFromArrays(literals, clauseOffsets)
+
+    _nonClause = re.compile(rb'^[cp%].*$', re.M)
+
+    def initFromArrays(self, literals, clauseOffsets):
+        """ Given the flat literal buffer and the clause offsets,
+        build the occurrence index and initialize the object.
+        numVars must be set beforehand.
+        """
+        literals = np.ascontiguousarray(literals, dtype=np.int32)
+        clauseOffsets = np.ascontiguousarray(clauseOffsets, dtype=np.int32)
+        numClauses = len(clauseOffsets) - 1
+        lengths = np.diff(clauseOffsets)
+
+        # Counting pass: the number of occurrences of each literal gives the
+        # occurrence offsets by a prefix sum; a stable sort of the literals
+        # then lays out the clause indices literal by literal.
+        slots = literals + self.numVars
+        counts = np.bincount(slots, minlength=2*self.numVars+1)
+        occurrenceOffsets = np.zeros(len(counts)+1, dtype=np.int32)
+        np.cumsum(counts, out=occurrenceOffsets[1:])
+        clauseIdx = np.repeat(
+            np.arange(numClauses, dtype=np.int32),
+            lengths
+        )
+        # Small keys let numpy use a radix sort.
+        if len(counts) <= np.iinfo(np.uint16).max:
+            slots = slots.astype(np.uint16)
+        occurrenceIndex = clauseIdx[np.argsort(slots, kind='stable')]
+
+        self.initFromIndex(
+            literals,
+            clauseOffsets,
+            occurrenceIndex,
+            occurrenceOffsets,
+        )
+
+    def initFromIndex(self,
+                      literals,
+                      clauseOffsets,
+                      occurrenceIndex,
+                      occurrenceOffsets):
+        """ Initialize the object from an already built clause buffer and
+        occurrence index. numVars must be set beforehand.
+        """
+        self.literals = literals
+        self.clauseOffsets = clauseOffsets
+        self.occurrenceIndex = occurrenceIndex
+        self.occurrenceOffsets = occurrenceOffsets
+        self.numClauses = len(clauseOffsets) - 1
+        self.maxClauseLength = int(
+            np.diff(clauseOffsets).max() if self.numClauses > 0 else 0
+        )
+        self.maxOccs = int(np.diff(occurrenceOffsets).max())
+        self.initIndex()
+
+        self.ratio = self.numClauses / self.numVars
+        self.isInit = True
+
+
+
 
 class Assignment:
 
-    def __init__(self, atoms = None, varCount = None, seed = None):
+    def __init__(self, atoms = None, varCount = None, seed = None,
+                 stream = None):
         if atoms == None and varCount == None:
             self.atoms = None
             self.varCount = None
@@ -299,7 +861,9 @@ class Assignment:
             if not type(varCount) == int:
                 raise TypeError("varCount was no int.")
             self.varCount = varCount
-            self.initRandomly()
+            if stream == None and seed != None:
+                stream = RandomStream(seed)
+            self.initRandomly(stream)
         else:
             if varCount == None:
                 self.varCount = len(atoms)
@@ -314,7 +878,14 @@ class Assignment:
                     self.atoms = atoms
 
 
-    def initRandomly(self):
+    def initRandomly(self, stream = None):
+        if stream != None:
+            if not isinstance(stream, RandomStream):
+                raise TypeError("stream = {} is no RandomStream."
+                                .format(stream))
+            self.atoms = [None] + stream.bools(self.varCount)
+            return
+
         self.atoms = [None]
         for i in range(1, self.varCount+1):
             if random.randint(0,1) == 0:
@@ -368,6 +939,47 @@ class Assignment:
 
 
 
+class TruthAssignment(Assignment):
+    """ An Assignment which also keeps a literal-indexed truth table:
+    truth[lit] is 1 if lit is true, and 0 otherwise, so the truth of a
+    literal is a single index. truth has 2*varCount+1 entries, so that
+    python's negative indexing maps -x to entry 2*varCount+1-x, and
+    truth[0] is 0, which lets 0-padded clauses be evaluated directly.
+    """
+    def __init__(self, atoms = None, varCount = None, seed = None,
+                 stream = None):
+        self.truth = None
+        super().__init__(atoms, varCount, seed, stream)
+        if self.atoms != None and self.truth == None:
+            self.initTruth()
+
+
+    def initRandomly(self, stream = None):
+        """ Draw new atoms, and rebuild the truth table in place. """
+        super().initRandomly(stream)
+        self.initTruth()
+
+
+    def initTruth(self):
+        """ Rebuild the truth table from atoms, reusing its buffer. """
+        n = self.varCount
+        values = np.array(self.atoms[1:n+1], dtype=bool)
+        truth = np.zeros(2*n+1, dtype=np.uint8)
+        truth[1:n+1] = values
+        truth[n+1:] = ~values[::-1]
+        if self.truth == None:
+            self.truth = bytearray(truth.tobytes())
+        else:
+            self.truth[:] = truth.tobytes()
+
+
+    def flip(self, var):
+        super().flip(var)
+        self.truth[var] ^= 1
+        self.truth[-var] ^= 1
+
+
+
 class Breakscore:
     def __init__(self, formula, assignment, falselist):
         if not isinstance(formula, CNF):
@@ -482,3 +1094,171 @@ class Breakscore:
                         self.critVar[clauseIdx] = abs(lit)
                         self.incrementBreakScore(abs(lit))
             self.numTrueLit[clauseIdx] -= 1
+
+
+
+class ArrayBreakscore:
+    """ A Breakscore for the inner loop of the solver: breaks, numTrueLit
+    and trueXor are preallocated lists indexed by variable and clause
+    (plain lists index faster than array('i') in CPython), and the formula,
+    assignment and falselist are checked once at construction, not on
+    every flip.
+
+    trueXor holds the xor of the variables of the true literals of each
+    clause; if a clause has exactly one true literal, this is its critical
+    variable, so it never has to be searched for.
+
+    weights holds probs[breaks[x]] for each literal of x, kept up to date on
+    every change of a break score. It is indexed by the literal itself:
+    with its 2*numVars+1 entries, python's negative indexing maps -x to
+    entry 2*numVars+1-x. Without probs, all weights are 1.
+    """
+    def __init__(self, formula, assignment, falselist, probs=None):
+        if not isinstance(formula, CNF):
+            raise TypeError("The given object formula={} is no cnf-formula."
+                            .format(formula))
+        if not isinstance(assignment, TruthAssignment):
+            raise TypeError("The given object assignment={} is no truth assignment."
+                            .format(assignment))
+        if not isinstance(falselist, Falselist):
+            raise TypeError("The given object falselist={} is no falselist."
+                            .format(falselist))
+        if assignment.varCount != formula.numVars:
+            raise ValueError("varCount = {} and numVars = {} do not match."
+                             .format(assignment.varCount, formula.numVars))
+
+        self.formula = formula
+        self.assignment = assignment
+        self.falselist = falselist
+
+        if probs == None:
+            probs = [1.0]*(formula.maxOccs+1)
+        elif len(probs) <= formula.maxOccs:
+            raise ValueError("len(probs) = {} does not cover maxOccs = {}."
+                             .format(len(probs), formula.maxOccs))
+        self.probs = probs
+
+        self.breaks = [0]*(formula.numVars+1)
+        self.numTrueLit = [0]*formula.numClauses
+        self.trueXor = [0]*formula.numClauses
+        self.weights = [probs[0]]*(2*formula.numVars+1)
+        if isinstance(formula, CompactCNF):
+            self.clauseVars = np.abs(formula.clauseMatrix())
+        self.reset()
+
+
+    def reset(self):
+        """ Recompute everything from the current assignment, e.g. after it
+        was drawn anew for a restart, reusing the preallocated lists. The
+        falselist is cleared and refilled.
+        """
+        formula = self.formula
+        n = formula.numVars
+        falselist = self.falselist
+        falselist.clear()
+
+        if not isinstance(formula, CompactCNF):
+            self.resetByClauses()
+            return
+
+        # Evaluate all clauses at once on the 0-padded clause matrix.
+        truth = np.frombuffer(self.assignment.truth, dtype=np.uint8)
+        isTrue = truth[formula.clauseMatrix()].view(bool)
+        numTrueLit = np.count_nonzero(isTrue, axis=1)
+        trueXor = np.bitwise_xor.reduce(
+            np.where(isTrue, self.clauseVars, 0),
+            axis=1,
+        )
+        breaks = np.bincount(trueXor[numTrueLit == 1], minlength=n+1)
+        weights = np.asarray(self.probs)[breaks]
+
+        self.numTrueLit[:] = numTrueLit.tolist()
+        self.trueXor[:] = trueXor.tolist()
+        self.breaks[:] = breaks.tolist()
+        self.weights[1:n+1] = weights[1:].tolist()
+        self.weights[n+1:] = weights[:0:-1].tolist()
+        for clauseIdx in np.flatnonzero(numTrueLit == 0).tolist():
+            falselist.add(clauseIdx)
+
+
+    def resetByClauses(self):
+        """ reset for formulae without clause matrix. """
+        breaks = self.breaks
+        truth = self.assignment.truth
+        for variable in range(0, len(breaks)):
+            breaks[variable] = 0
+        for clauseIdx, clause in enumerate(self.formula.clauses):
+            numTrueLit = 0
+            trueXor = 0
+            for lit in clause:
+                if truth[lit]:
+                    trueXor ^= abs(lit)
+                    numTrueLit += 1
+
+            self.numTrueLit[clauseIdx] = numTrueLit
+            self.trueXor[clauseIdx] = trueXor
+            if numTrueLit == 1:
+                breaks[trueXor] += 1
+            elif numTrueLit == 0:
+                self.falselist.add(clauseIdx)
+
+        for variable in range(1, len(breaks)):
+            self.weights[variable] = self.probs[breaks[variable]]
+            self.weights[-variable] = self.weights[variable]
+
+
+    def getBreakScore(self, variable):
+        return self.breaks[variable]
+
+
+    def getCritVar(self, clauseIdx):
+        """ The critical variable of a clause with exactly one true
+        literal.
+        """
+        return self.trueXor[clauseIdx]
+
+
+    def flip(self, variable):
+        """ Flip variable in the assignment, and update the break scores,
+        the true literal counts, the weights and the list of false clauses.
+        """
+        atoms = self.assignment.atoms
+        truth = self.assignment.truth
+        breaks = self.breaks
+        weights = self.weights
+        probs = self.probs
+        numTrueLit = self.numTrueLit
+        trueXor = self.trueXor
+        falselist = self.falselist
+
+        atoms[variable] = not atoms[variable]
+        satisfyingLiteral = variable if atoms[variable] else -variable
+        truth[satisfyingLiteral] = 1
+        truth[-satisfyingLiteral] = 0
+
+        for clauseIdx in self.formula.getOccurrences(satisfyingLiteral):
+            n = numTrueLit[clauseIdx]
+            if n == 0:
+                falselist.discard(clauseIdx)
+                breaks[variable] += 1
+            elif n == 1:
+                x = trueXor[clauseIdx]
+                breaks[x] -= 1
+                weights[x] = weights[-x] = probs[breaks[x]]
+            numTrueLit[clauseIdx] = n + 1
+            trueXor[clauseIdx] ^= variable
+
+        for clauseIdx in self.formula.getOccurrences(-satisfyingLiteral):
+            n = numTrueLit[clauseIdx]
+            x = trueXor[clauseIdx] ^ variable
+            if n == 1:
+                falselist.add(clauseIdx)
+                breaks[variable] -= 1
+            elif n == 2:
+                # x is the only variable still satisfying the clause.
+                breaks[x] += 1
+                weights[x] = weights[-x] = probs[breaks[x]]
+            numTrueLit[clauseIdx] = n - 1
+            trueXor[clauseIdx] = x
+
+        weights[variable] = weights[-variable] = probs[breaks[variable]]
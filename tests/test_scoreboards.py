@@ -0,0 +1,103 @@
+""" Regression checks of the incremental solver state: after random flips
+and restarts, the true literal counts, xors, break scores and false
+clauses must equal those recomputed from scratch.
+"""
+
+import random
+import numpy as np
+import pytest
+
+from sat.utils import (CNF, CompactCNF, TruthAssignment, ArrayFalselist,
+                       ArrayBreakscore)
+from sat.batch_prob_sat import BatchProbSAT
+
+
+def writeFormula(path, numVars=30, numClauses=128, k=3, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('p cnf {} {}\n'.format(numVars, numClauses))
+        for _ in range(numClauses):
+            clause = [v if rng.random() < 0.5 else -v
+                      for v in rng.sample(range(1, numVars+1), k)]
+            f.write(' '.join(map(str, clause)) + ' 0\n')
+    return str(path)
+
+
+def recompute(clauses, numVars, isTrue):
+    """ numTrueLit, trueXor, breaks and the set of false clauses, from
+    scratch.
+    """
+    numTrueLit = []
+    trueXor = []
+    breaks = [0]*(numVars+1)
+    false = set()
+    for clauseIdx, clause in enumerate(clauses):
+        true = [abs(lit) for lit in clause if isTrue(lit)]
+        numTrueLit.append(len(true))
+        xor = 0
+        for var in true:
+            xor ^= var
+        trueXor.append(xor)
+        if len(true) == 1:
+            breaks[true[0]] += 1
+        elif len(true) == 0:
+            false.add(clauseIdx)
+    return numTrueLit, trueXor, breaks, false
+
+
+@pytest.fixture
+def formulaPath(tmp_path):
+    return writeFormula(tmp_path / 'random.cnf')
+
+
+@pytest.mark.parametrize('formulaClass', [CNF, CompactCNF])
+def test_array_breakscore(formulaPath, formulaClass):
+    formula = formulaClass(formulaPath)
+    n = formula.numVars
+    probs = [(1.0 + b)**-2.3 for b in range(formula.maxOccs+1)]
+    assignment = TruthAssignment(varCount=n, seed=1)
+    falselist = ArrayFalselist(formula.numClauses)
+    scoreboard = ArrayBreakscore(formula, assignment, falselist, probs)
+    clauses = [list(clause) for clause in formula.clauses]
+    rng = random.Random(2)
+
+    for restart in range(3):
+        for _ in range(200):
+            scoreboard.flip(rng.randint(1, n))
+            numTrueLit, trueXor, breaks, false = recompute(
+                clauses, n, lambda lit: assignment.truth[lit] == 1)
+            assert scoreboard.numTrueLit == numTrueLit
+            assert scoreboard.trueXor == trueXor
+            assert scoreboard.breaks == breaks
+            assert set(falselist.lst[:falselist.count]) == false
+            assert falselist.count == len(false)
+            for var in range(1, n+1):
+                assert scoreboard.weights[var] == probs[breaks[var]]
+                assert scoreboard.weights[-var] == probs[breaks[var]]
+                assert assignment.truth[var] == int(assignment.atoms[var])
+        assignment.initRandomly()
+        scoreboard.reset()
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_batch_prob_sat(formulaPath, seed):
+    formula = CompactCNF(formulaPath)
+    n = formula.numVars
+    clauses = [list(clause) for clause in formula.clauses]
+    # Few flips and several tries, so the walks restart.
+    solver = BatchProbSAT(formula, walks=8, maxFlips=50, maxTries=3)
+    solver.solve(seed)
+    assert len(solver.runs) > solver.walks
+
+    for w in range(solver.walks):
+        atoms = solver.atoms[w]
+        numTrueLit, trueXor, breaks, false = recompute(
+            clauses, n, lambda lit: (atoms[abs(lit)] == 1) == (lit > 0))
+        assert solver.numTrueLit[w].tolist() == numTrueLit
+        assert solver.trueXor[w].tolist() == trueXor
+        assert solver.breaks[w].tolist() == breaks
+        count = solver.numFalse[w]
+        falseLst = solver.falseLst[w, :count]
+        assert set(falseLst.tolist()) == false
+        assert count == len(false)
+        assert (solver.falsePos[w, falseLst] == np.arange(count)).all()